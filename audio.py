@@ -0,0 +1,249 @@
+import os
+import subprocess
+from bisect import bisect_right
+
+import numpy as np
+
+# Discord voice receive format: 48 kHz, 16-bit, stereo PCM
+DISCORD_SAMPLE_RATE = 48000
+DISCORD_CHANNELS = 2
+SAMPLE_WIDTH = 2
+PCM_BYTES_PER_SECOND = DISCORD_SAMPLE_RATE * DISCORD_CHANNELS * SAMPLE_WIDTH
+
+# Whisper expects 16 kHz mono float32
+WHISPER_SAMPLE_RATE = 16000
+
+# Frames mixed per step by the streaming mixer (1 second of audio)
+MIX_BLOCK_FRAMES = DISCORD_SAMPLE_RATE
+
+# Voice activity detection: only speech regions are sent to Whisper
+VAD_ENABLED = os.getenv('VAD_ENABLED', '1') == '1'
+VAD_THRESHOLD_DB = float(os.getenv('VAD_THRESHOLD_DB', '-45'))
+VAD_FRAME_SECONDS = 0.03
+VAD_PAD_SECONDS = 0.4   # kept around each region so words aren't clipped
+VAD_GAP_SECONDS = 0.1   # silence inserted between regions when they're joined
+
+
+def pcm_to_whisper(pcm):
+    """Convert raw Discord PCM to 16 kHz mono float32 without leaving NumPy"""
+    samples = np.frombuffer(pcm, dtype=np.int16)
+    frames = len(samples) // DISCORD_CHANNELS
+    stereo = samples[:frames * DISCORD_CHANNELS].reshape(frames, DISCORD_CHANNELS)
+    mono = stereo.mean(axis=1, dtype=np.float32) / 32768.0
+    
+    # 48 kHz -> 16 kHz: average each group of 3 samples (cheap low-pass + decimate)
+    factor = DISCORD_SAMPLE_RATE // WHISPER_SAMPLE_RATE
+    usable = len(mono) // factor * factor
+    return mono[:usable].reshape(-1, factor).mean(axis=1)
+
+
+def segments_to_whisper(paths):
+    """Convert a speaker's spilled PCM segment files to 16 kHz mono float32
+
+    Segments are converted one at a time, so only the (much smaller) 16 kHz
+    output is ever held for the whole recording.
+    """
+    pieces = []
+    for path in paths:
+        with open(path, "rb") as f:
+            pieces.append(pcm_to_whisper(f.read()))
+    if not pieces:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate(pieces)
+
+
+def detect_speech(samples, sample_rate=WHISPER_SAMPLE_RATE):
+    """Find speech in a float32 signal by frame energy
+
+    Returns a list of (start, end) sample indices. The threshold adapts to the
+    stream's own noise floor but never drops below VAD_THRESHOLD_DB.
+    """
+    frame = int(sample_rate * VAD_FRAME_SECONDS)
+    count = len(samples) // frame
+    if count == 0:
+        return []
+    
+    frames = samples[:count * frame].reshape(count, frame)
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    db = 20 * np.log10(np.maximum(rms, 1e-10))
+    
+    noise_floor = np.percentile(db, 10)
+    threshold = min(max(VAD_THRESHOLD_DB, noise_floor + 12), -30.0)
+    speech = db > threshold
+    
+    # Pad each region (this also merges regions separated by short pauses)
+    pad = int(VAD_PAD_SECONDS / VAD_FRAME_SECONDS)
+    if pad:
+        speech = np.convolve(speech.astype(np.int8), np.ones(2 * pad + 1, dtype=np.int8), mode='same') > 0
+    
+    edges = np.diff(np.concatenate(([0], speech.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return [(int(start) * frame, int(end) * frame) for start, end in zip(starts, ends)]
+
+
+def compact_speech(samples, regions, sample_rate=WHISPER_SAMPLE_RATE):
+    """Join speech regions into one shorter signal
+
+    Returns (samples, region_map) where region_map lists
+    (offset in compacted audio, offset in original audio) in seconds.
+    """
+    gap = np.zeros(int(sample_rate * VAD_GAP_SECONDS), dtype=np.float32)
+    pieces = []
+    region_map = []
+    position = 0
+    for start, end in regions:
+        region_map.append((position / sample_rate, start / sample_rate))
+        pieces.append(samples[start:end])
+        pieces.append(gap)
+        position += end - start + len(gap)
+    
+    if not pieces:
+        return np.zeros(0, dtype=np.float32), []
+    return np.concatenate(pieces), region_map
+
+
+def map_timestamps(segments, region_map):
+    """Shift segment start/end from compacted time back to session time"""
+    if not region_map:
+        return segments
+    
+    compact_starts = [compact for compact, original in region_map]
+    
+    def to_session_time(t):
+        index = max(bisect_right(compact_starts, t) - 1, 0)
+        compact, original = region_map[index]
+        return original + (t - compact)
+    
+    return [{**seg, 'start': to_session_time(seg['start']), 'end': to_session_time(seg['end'])}
+            for seg in segments]
+
+
+class SegmentReader:
+    """Reads a list of PCM segment files as one continuous stream
+
+    lead_bytes of silence come first, so a speaker who joined late lines up
+    with everyone else.
+    """
+
+    def __init__(self, paths, lead_bytes=0):
+        self._paths = list(paths)
+        self._file = None
+        self._lead = lead_bytes
+
+    def read(self, size):
+        # Only returns short at the end of the last segment, like a pipe
+        silence = min(self._lead, size)
+        self._lead -= silence
+        out = bytearray(silence)
+        while len(out) < size:
+            if self._file is None:
+                if not self._paths:
+                    break
+                self._file = open(self._paths.pop(0), "rb")
+            chunk = self._file.read(size - len(out))
+            if not chunk:
+                self._file.close()
+                self._file = None
+                continue
+            out.extend(chunk)
+        return bytes(out)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._paths = []
+
+
+def read_pcm_range(paths, start, end):
+    """Bytes start..end of a speaker's stream, read from their segment files
+
+    Segments before start are skipped by size, so only the range itself is read.
+    """
+    out = bytearray()
+    position = 0
+    for path in paths:
+        size = os.path.getsize(path)
+        if position + size > start and position < end:
+            with open(path, "rb") as f:
+                f.seek(max(start - position, 0))
+                out.extend(f.read(min(end, position + size) - max(start, position)))
+        position += size
+        if position >= end:
+            break
+    return bytes(out)
+
+
+def mix_to_file(streams, out_file, offsets=None, block_frames=MIX_BLOCK_FRAMES):
+    """Mix every speaker into out_file one block at a time
+
+    streams maps user id -> that speaker's spilled PCM segment files, and
+    offsets maps user id -> when their stream starts in the session (seconds).
+    Streams are read in fixed-size blocks, which are summed in int32, clipped and piped to
+    an encoder, so memory use doesn't grow with the length of the session.
+    Returns the number of frames written.
+    """
+    block_bytes = block_frames * DISCORD_CHANNELS * SAMPLE_WIDTH
+    frame_bytes = DISCORD_CHANNELS * SAMPLE_WIDTH
+    
+    offsets = offsets or {}
+    readers = [
+        SegmentReader(paths, int(offsets.get(user_id, 0.0) * DISCORD_SAMPLE_RATE) * frame_bytes)
+        for user_id, paths in streams.items() if paths
+    ]
+    if not readers:
+        return 0
+    
+    encoder = subprocess.Popen(
+        ['ffmpeg', '-loglevel', 'error', '-y',
+         '-f', 's16le', '-ac', str(DISCORD_CHANNELS), '-ar', str(DISCORD_SAMPLE_RATE),
+         '-i', 'pipe:0', out_file],
+        stdin=subprocess.PIPE
+    )
+    
+    frames_written = 0
+    mixed = np.zeros(block_frames * DISCORD_CHANNELS, dtype=np.int32)
+    active = list(readers)
+    try:
+        while active:
+            mixed.fill(0)
+            longest = 0
+            for reader in list(active):
+                # read(n) only returns short at end of stream
+                chunk = reader.read(block_bytes)
+                chunk = chunk[:len(chunk) // frame_bytes * frame_bytes]
+                if len(chunk) < block_bytes:
+                    active.remove(reader)
+                if not chunk:
+                    continue
+                
+                samples = np.frombuffer(chunk, dtype=np.int16)
+                mixed[:len(samples)] += samples
+                longest = max(longest, len(samples))
+            
+            if longest:
+                block = np.clip(mixed[:longest], -32768, 32767).astype(np.int16)
+                encoder.stdin.write(block.tobytes())
+                frames_written += longest // DISCORD_CHANNELS
+    finally:
+        encoder.stdin.close()
+        encoder.wait()
+        for reader in readers:
+            reader.close()
+    
+    return frames_written
+
+
+def mix_recording(streams, offsets, basename):
+    """Mix every speaker's audio into an mp3 archive
+
+    streams maps user id -> a list of PCM segment files and offsets maps user
+    id -> when that stream starts in the session (seconds). Returns the mp3
+    filename, or None if there was nothing to mix. Runs inside a worker
+    process.
+    """
+    mp3_file = f"{basename}.mp3"
+    if mix_to_file(streams, mp3_file, offsets) == 0:
+        return None
+    return mp3_file
@@ -0,0 +1,190 @@
+import asyncio
+import hashlib
+import json
+import os
+import subprocess
+import threading
+import time
+
+# Where cached tracks live and how much disk they may use
+AUDIO_CACHE_DIR = os.getenv('AUDIO_CACHE_DIR', 'audio_cache')
+AUDIO_CACHE_MAX_BYTES = int(os.getenv('AUDIO_CACHE_MAX_MB', '2048')) * 1024 * 1024
+# Only play tracks that are already cached (no network needed)
+OFFLINE_MODE = os.getenv('OFFLINE_MODE', '0') == '1'
+
+INDEX_FILE = 'index.json'
+# Play times are written to the index at most this often (seconds)
+INDEX_SAVE_DELAY = 30.0
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class AudioCache:
+    """On-disk LRU cache of loudness-normalized Opus files keyed by webpage_url
+
+    Tracks are downloaded in the background after their first play. Each file's
+    size and SHA-256 are recorded; entries whose file is missing, truncated or
+    corrupted are dropped. The least recently played files are deleted once
+    the cache grows past max_bytes.
+    """
+
+    def __init__(self, directory=AUDIO_CACHE_DIR, max_bytes=AUDIO_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._filling = set()
+        self._fill_semaphore = None
+        self._save_handle = None
+        os.makedirs(directory, exist_ok=True)
+        self._entries = self._load_index()
+
+    def _index_path(self):
+        return os.path.join(self.directory, INDEX_FILE)
+
+    def _load_index(self):
+        try:
+            with open(self._index_path(), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_index(self):
+        # Caller must hold the lock; write to a temp file then rename so it's never half-written
+        temp_path = self._index_path() + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self._entries, f)
+        os.replace(temp_path, self._index_path())
+
+    def _schedule_save(self):
+        # Lookups run on the event loop for every play, so batch their writes and do them in a thread
+        if self._save_handle is None:
+            loop = asyncio.get_running_loop()
+            self._save_handle = loop.call_later(INDEX_SAVE_DELAY, lambda: asyncio.create_task(self._save_later()))
+
+    async def _save_later(self):
+        self._save_handle = None
+        await asyncio.to_thread(self.flush)
+
+    def flush(self):
+        """Write the index right now (e.g. on shutdown) so recent play times aren't lost"""
+        with self._lock:
+            self._save_index()
+
+    def _file_path(self, webpage_url):
+        key = hashlib.sha1(webpage_url.encode()).hexdigest()
+        return os.path.join(self.directory, f"{key}.opus")
+
+    def _drop(self, webpage_url):
+        # Caller must hold the lock
+        entry = self._entries.pop(webpage_url, None)
+        if entry is not None:
+            try:
+                os.remove(entry['file'])
+            except FileNotFoundError:
+                pass
+
+    def lookup(self, webpage_url):
+        """Cached entry (file, title, duration) for a track, or None; counts as a use"""
+        with self._lock:
+            entry = self._entries.get(webpage_url)
+            if entry is None:
+                return None
+            try:
+                size = os.path.getsize(entry['file'])
+            except OSError:
+                size = None
+            if size != entry['size']:
+                print(f"Cached audio for {webpage_url} is missing or truncated, dropping it")
+                self._drop(webpage_url)
+                self._schedule_save()
+                return None
+            entry['last_used'] = time.time()
+            self._schedule_save()
+            return dict(entry)
+
+    def verify(self):
+        """Check every file against its recorded hash; returns how many were dropped"""
+        with self._lock:
+            entries = list(self._entries.items())
+        
+        bad = []
+        for webpage_url, entry in entries:
+            try:
+                if file_sha256(entry['file']) != entry['sha256']:
+                    bad.append(webpage_url)
+            except OSError:
+                bad.append(webpage_url)
+        
+        if bad:
+            with self._lock:
+                for webpage_url in bad:
+                    self._drop(webpage_url)
+                self._save_index()
+            print(f"Dropped {len(bad)} corrupted audio cache entr{'y' if len(bad) == 1 else 'ies'}")
+        return len(bad)
+
+    def _download(self, track):
+        """Fetch and normalize one track into the cache (runs in a thread)"""
+        path = self._file_path(track.webpage_url)
+        temp_path = path + '.part'
+        subprocess.run(
+            ['ffmpeg', '-loglevel', 'error', '-y',
+             '-reconnect', '1', '-reconnect_streamed', '1', '-reconnect_delay_max', '5',
+             '-i', track.url, '-vn',
+             '-af', 'loudnorm=I=-16:TP=-1.5:LRA=11',
+             '-c:a', 'libopus', '-b:a', '128k', '-f', 'ogg', temp_path],
+            check=True
+        )
+        os.replace(temp_path, path)
+        
+        entry = {
+            'file': path,
+            'title': track.title,
+            'duration': track.duration,
+            'size': os.path.getsize(path),
+            'sha256': file_sha256(path),
+            'last_used': time.time()
+        }
+        with self._lock:
+            self._entries[track.webpage_url] = entry
+            self._evict()
+            self._save_index()
+        print(f"Cached audio for {track.title} ({entry['size'] // 1024} KB)")
+
+    def _evict(self):
+        # Caller must hold the lock; drop least recently used files until under the limit
+        total = sum(entry['size'] for entry in self._entries.values())
+        for webpage_url, entry in sorted(self._entries.items(), key=lambda item: item[1]['last_used']):
+            if total <= self.max_bytes:
+                break
+            total -= entry['size']
+            self._drop(webpage_url)
+
+    def schedule_fill(self, track):
+        """Download a just-played track in the background if it isn't cached yet"""
+        if track.url is None or track.webpage_url in self._entries or track.webpage_url in self._filling:
+            return
+        self._filling.add(track.webpage_url)
+        asyncio.create_task(self._fill(track))
+
+    async def _fill(self, track):
+        # One download at a time so playback keeps the bandwidth
+        if self._fill_semaphore is None:
+            self._fill_semaphore = asyncio.Semaphore(1)
+        try:
+            async with self._fill_semaphore:
+                await asyncio.to_thread(self._download, track)
+        except Exception as e:
+            print(f"Could not cache {track.title}: {e}")
+        finally:
+            self._filling.discard(track.webpage_url)
+
+
+# Shared cache for all guilds
+audio_cache = AudioCache()
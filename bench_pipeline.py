@@ -0,0 +1,296 @@
+"""Offline benchmark of the recording -> transcript -> summary pipeline
+
+Generates a synthetic multi-speaker recording (alternating tone bursts with
+quiet gaps), spills it through the recording sink and runs every stage of
+process_recording on it in this process: capture, decode, VAD, mixdown,
+export, transcription, transcript merge, prompt building and summarization.
+Whisper and Ollama are replaced by stand-ins unless asked for, so results only
+depend on this repo's code. Wall time, CPU time (ours and FFmpeg's) and peak
+RSS per stage are printed and written as JSON for comparing commits. Usage:
+
+    python bench_pipeline.py --speakers 5 --minutes 30 --output bench_pipeline.json
+    python bench_pipeline.py --backend faster-whisper --model tiny
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+import transcription
+from audio import (DISCORD_SAMPLE_RATE, DISCORD_CHANNELS, segments_to_whisper, map_timestamps,
+                   mix_to_file, VAD_ENABLED, WHISPER_SAMPLE_RATE)
+from llm import ollama
+from recording import SpillingSink, load_recording
+from summarizer import (build_char_context, build_chunk_prompt, build_summary_prompt,
+                        split_transcript, summarize_transcript)
+from transcription import (TranscriptionBackend, ModelCache, shift_segments, merge_speaker_segments,
+                           format_transcript)
+
+# py-cord delivers 20 ms of PCM per write
+FRAME_SAMPLES = DISCORD_SAMPLE_RATE // 50
+# Seconds of synthetic audio generated at a time
+GENERATE_BLOCK_SECONDS = 10
+
+WORDS = ("the party follows the goblin tracks north toward the ruined keep while "
+         "the wizard studies the strange runes and the rogue checks the door for traps").split()
+
+
+class StubBackend(TranscriptionBackend):
+    """Stand-in for Whisper: one fixed-length segment per few seconds of audio"""
+
+    name = 'stub'
+    segment_seconds = 4.0
+
+    def transcribe(self, samples):
+        duration = len(samples) / WHISPER_SAMPLE_RATE
+        segments = []
+        start = 0.0
+        while start < duration:
+            end = min(start + self.segment_seconds, duration)
+            first = int(start) % len(WORDS)
+            segments.append({'start': start, 'end': end, 'text': " ".join(WORDS[first:first + 10])})
+            start = end
+        return {'text': " ".join(seg['text'] for seg in segments), 'segments': segments}
+
+
+class StubLLM:
+    """Stand-in for the Ollama client: answers with canned text at a fixed token rate"""
+
+    def __init__(self, tokens=300, tokens_per_second=0):
+        self.tokens = tokens
+        self.delay = 1 / tokens_per_second if tokens_per_second else 0
+
+    def _reply(self):
+        return [WORDS[i % len(WORDS)] + " " for i in range(self.tokens)]
+
+    async def generate(self, prompt):
+        await asyncio.sleep(self.delay * self.tokens)
+        return "".join(self._reply())
+
+    async def stream(self, prompt):
+        for token in self._reply():
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            yield token
+
+
+class RssSampler:
+    """Tracks this process's peak resident memory while a stage runs"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+    def _rss(self):
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * self._page_size
+        except OSError:
+            # No procfs: fall back to the lifetime high-water mark (KiB on Linux)
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self._rss()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._rss())
+
+
+def children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class StageTimer:
+    """Runs pipeline stages and records wall time, CPU time and peak RSS for each"""
+
+    def __init__(self):
+        self.results = {}
+
+    def run(self, name, fn, *args):
+        children_before = children_cpu()
+        cpu_before = time.process_time()
+        wall_before = time.perf_counter()
+        with RssSampler() as rss:
+            result = fn(*args)
+        self.results[name] = {
+            'wall_s': round(time.perf_counter() - wall_before, 4),
+            'cpu_s': round(time.process_time() - cpu_before, 4),
+            'ffmpeg_cpu_s': round(children_cpu() - children_before, 4),
+            'peak_rss_mb': round(rss.peak / 1024 / 1024, 1),
+        }
+        return result
+
+
+def synth_speaker(index, seconds, seed):
+    """Yield one speaker's PCM in blocks, each either a voiced burst (about a third) or quiet noise"""
+    rng = np.random.default_rng(seed + index)
+    pitch = 110 + 40 * index
+    block = GENERATE_BLOCK_SECONDS * DISCORD_SAMPLE_RATE
+    for block_start in range(0, int(seconds * DISCORD_SAMPLE_RATE), block):
+        frames = min(block, int(seconds * DISCORD_SAMPLE_RATE) - block_start)
+        t = (block_start + np.arange(frames)) / DISCORD_SAMPLE_RATE
+        voice = sum(np.sin(2 * np.pi * pitch * k * t) / k for k in (1, 2, 3))
+        # Syllable-rate wobble so it isn't a pure tone
+        voice *= 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t) ** 2
+        signal = rng.normal(0, 0.002, frames)
+        speaking = rng.random() < 0.35
+        if speaking:
+            signal += 0.3 * voice
+        pcm = np.clip(signal * 32767, -32768, 32767).astype(np.int16)
+        yield np.repeat(pcm, DISCORD_CHANNELS).tobytes()
+
+
+def capture(directory, speakers, seconds, seed):
+    """Feed synthetic audio through the spilling sink in 20 ms frames, like the voice client"""
+    sink = SpillingSink(0, directory=directory)
+    frame_bytes = FRAME_SAMPLES * DISCORD_CHANNELS * 2
+    generators = [synth_speaker(i, seconds, seed) for i in range(speakers)]
+    for blocks in zip(*generators):
+        for user_id, data in enumerate(blocks, start=1):
+            for offset in range(0, len(data), frame_bytes):
+                sink.write(data[offset:offset + frame_bytes], user_id)
+    sink.close()
+    return sink.directory
+
+
+def decode(streams):
+    return {user_id: segments_to_whisper(paths) for user_id, paths in streams.items()}
+
+
+def vad(samples):
+    return {user_id: transcription._prepare(signal) for user_id, signal in samples.items()}
+
+
+def transcribe(prepared, offsets, size):
+    per_user = {}
+    for user_id, (signal, region_map) in prepared.items():
+        segments = []
+        if len(signal):
+            with transcription.model_cache.use(size) as model:
+                segments = model.transcribe(signal)['segments']
+        per_user[user_id] = shift_segments(map_timestamps(segments, region_map), offsets[user_id])
+    return per_user
+
+
+def export(wav_file, mp3_file):
+    subprocess.run(['ffmpeg', '-loglevel', 'error', '-y', '-i', wav_file, mp3_file], check=True)
+
+
+def merge(per_user):
+    return format_transcript(merge_speaker_segments(
+        {f"Player {user_id}": segments for user_id, segments in per_user.items()}
+    ))
+
+
+def build_prompts(transcript, char_context):
+    chunks = split_transcript(transcript)
+    if len(chunks) <= 1:
+        return [build_summary_prompt(transcript, char_context)]
+    return [build_chunk_prompt(chunk, char_context, i + 1, len(chunks)) for i, chunk in enumerate(chunks)]
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args):
+    backend = args.backend
+    if backend == 'stub':
+        transcription.BACKENDS['stub'] = StubBackend
+    # Models load outside the timed stages, the same way the bot warms them at startup
+    transcription.model_cache = ModelCache(idle_timeout=0, backend=backend)
+    transcription.model_cache.warm(args.model)
+
+    seconds = args.minutes * 60
+    char_map = {str(i): {'character_info': f"Hero {i}"} for i in range(1, args.speakers + 1)}
+    char_context = build_char_context(char_map)
+    client = ollama if args.ollama else StubLLM(tokens=args.llm_tokens, tokens_per_second=args.llm_rate)
+    timer = StageTimer()
+
+    with tempfile.TemporaryDirectory() as work:
+        directory = timer.run('capture', capture, work, args.speakers, seconds, args.seed)
+        streams, offsets = load_recording(directory)
+        samples = timer.run('decode', decode, streams)
+        prepared = timer.run('vad', vad, samples)
+        del samples
+
+        wav_file = os.path.join(work, 'mix.wav')
+        timer.run('mixdown', mix_to_file, streams, wav_file, offsets)
+        timer.run('export', export, wav_file, os.path.join(work, 'mix.mp3'))
+
+        per_user = timer.run('transcription', transcribe, prepared, offsets, args.model)
+        del prepared
+        transcript = timer.run('merge', merge, per_user)
+        timer.run('prompts', build_prompts, transcript, char_context)
+
+        async def summarize():
+            try:
+                return await summarize_transcript(transcript, char_context, client=client)
+            finally:
+                if client is ollama:
+                    await client.close()
+        timer.run('summarization', asyncio.run, summarize())
+
+    report = {
+        'commit': git_commit(),
+        'config': {
+            'speakers': args.speakers,
+            'minutes': args.minutes,
+            'seed': args.seed,
+            'backend': backend,
+            'model': args.model,
+            'llm': 'ollama' if args.ollama else f"stub ({args.llm_tokens} tokens at {args.llm_rate or 'unlimited'}/s)",
+            'vad': VAD_ENABLED,
+        },
+        'transcript_chars': len(transcript),
+        'stages': timer.results,
+    }
+
+    print(f"{'stage':<14} {'wall s':>9} {'cpu s':>9} {'ffmpeg s':>9} {'peak MB':>9}")
+    for name, stage in timer.results.items():
+        print(f"{name:<14} {stage['wall_s']:>9.2f} {stage['cpu_s']:>9.2f} "
+              f"{stage['ffmpeg_cpu_s']:>9.2f} {stage['peak_rss_mb']:>9.1f}")
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--speakers', type=int, default=4)
+    parser.add_argument('--minutes', type=float, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backend', default='stub',
+                        help="'stub' (default), 'whisper' or 'faster-whisper'")
+    parser.add_argument('--model', default='tiny', help="model size for a real backend")
+    parser.add_argument('--ollama', action='store_true', help="summarize with the real Ollama server")
+    parser.add_argument('--llm-tokens', type=int, default=300, help="tokens per stub LLM reply")
+    parser.add_argument('--llm-rate', type=float, default=0, help="stub LLM tokens/sec (0 = instant)")
+    parser.add_argument('--output', default='bench_pipeline.json')
+    main(parser.parse_args())
@@ -0,0 +1,89 @@
+"""Compare CPU cost of the Opus passthrough and PCM playback paths
+
+Reads a track as fast as possible through each kind of audio source, the
+same way the voice client does (encoding PCM frames to Opus for the PCM
+path), and reports CPU seconds per minute of audio for the bot process and
+for FFmpeg. Usage:
+
+    python bench_playback.py <youtube url or audio file> [--seconds 120]
+"""
+import argparse
+import asyncio
+import resource
+import time
+
+import discord
+
+from player import FFMPEG_BEFORE_OPTIONS, FFMPEG_OPTIONS, OPUS_BITRATE
+from resolver import resolver
+
+FRAME_SECONDS = 0.02
+
+
+def children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_source(source, seconds, encode):
+    """Pull seconds of audio from source; returns (frames, bot cpu, ffmpeg cpu, wall)"""
+    encoder = discord.opus.Encoder() if encode else None
+    
+    children_before = children_cpu()
+    cpu_before = time.process_time()
+    wall_before = time.perf_counter()
+    
+    frames = 0
+    for _ in range(int(seconds / FRAME_SECONDS)):
+        data = source.read()
+        if not data:
+            break
+        if encoder is not None:
+            encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+        frames += 1
+    
+    cpu = time.process_time() - cpu_before
+    # cleanup() waits for FFmpeg, so its CPU time shows up in the children totals
+    source.cleanup()
+    wall = time.perf_counter() - wall_before
+    return frames, cpu, children_cpu() - children_before, wall
+
+
+async def main(target, seconds):
+    if target.startswith('http'):
+        info = await resolver.resolve(target)
+        stream_url, codec = info['url'], info['codec']
+        print(f"Track: {info['title']} (codec: {codec})")
+    else:
+        stream_url = target
+        codec, _ = await discord.FFmpegOpusAudio.probe(target)
+        print(f"File: {target} (codec: {codec})")
+    
+    before = FFMPEG_BEFORE_OPTIONS if target.startswith('http') else None
+    paths = {
+        'pcm': (lambda: discord.FFmpegPCMAudio(stream_url, **(FFMPEG_OPTIONS if before else {'options': '-vn'})), True),
+        'opus-encode': (lambda: discord.FFmpegOpusAudio(stream_url, bitrate=OPUS_BITRATE,
+                                                        before_options=before, options='-vn'), False),
+    }
+    if codec == 'opus':
+        # codec='opus' is what makes py-cord pass the packets through ('-c:a copy')
+        paths['opus-copy'] = (lambda: discord.FFmpegOpusAudio(stream_url, codec='opus',
+                                                              before_options=before, options='-vn'), False)
+    
+    print(f"{'path':<12} {'audio s':>8} {'bot cpu/min':>12} {'ffmpeg cpu/min':>15} {'total cpu/min':>14}")
+    for name, (make_source, encode) in paths.items():
+        frames, cpu, ffmpeg_cpu, wall = await asyncio.to_thread(run_source, make_source(), seconds, encode)
+        audio_minutes = frames * FRAME_SECONDS / 60
+        if audio_minutes == 0:
+            print(f"{name:<12} no audio")
+            continue
+        print(f"{name:<12} {frames * FRAME_SECONDS:>8.1f} {cpu / audio_minutes:>12.2f} "
+              f"{ffmpeg_cpu / audio_minutes:>15.2f} {(cpu + ffmpeg_cpu) / audio_minutes:>14.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('target')
+    parser.add_argument('--seconds', type=float, default=120)
+    args = parser.parse_args()
+    asyncio.run(main(args.target, args.seconds))
@@ -1,31 +1,33 @@
-import yt_dlp
 import discord
 import os
 import time
 from dotenv import load_dotenv
 import asyncio
 from datetime import datetime
-import whisper
-import requests
 import json
+import traceback
+import metrics
+from transcription import (transcribe_speaker, shift_segments, merge_speaker_segments,
+                           format_transcript, format_timestamp, WHISPER_MODEL, MODEL_SIZES)
+from audio import mix_recording
+from summarizer import build_char_context, summarize_transcript, update_recap, PROMPT_VERSION
+from llm import OLLAMA_MODEL
+from workers import transcription_pool
+from live_transcription import LiveTranscriber
+from recording import SpillingSink, load_recording, find_recordings, discard_recording
+from resolver import resolver
+from player import create_source, create_local_source, PREFETCH_LEAD_SECONDS
+from audio_cache import audio_cache, OFFLINE_MODE
+from sessions import SessionManager
+from campaigns import campaigns, campaign_key, write_atomic
+from jobs import jobs, STAGE_LABELS
+from transcripts import transcript_store
+from summaries import summary_store, content_hash
+from tracks import Track
+from queue_view import QueueView, render_page, current_page
 
-# yt-dlp options for extracting audio
-YTDL_OPTIONS = {
-    'format': 'bestaudio/best',
-    'noplaylist': True,
-    'quiet': False,
-    'no_warnings': False,
-    'default_search': 'auto',
-    'source_address': '0.0.0.0',
-    'postprocessors': [{
-        'key': 'FFmpegExtractAudio',
-        'preferredcodec': 'opus',
-    }],
-}
-
-FFMPEG_OPTIONS = {
-    'options': '-vn -b:a 128k'
-}
+# How many playlist entries are looked up at the same time
+PLAYLIST_RESOLVE_CONCURRENCY = 4
 
 # Load the bot token from .env file
 load_dotenv()
@@ -36,73 +38,133 @@ intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 
-bot = discord.Bot(intents=intents, debug_guilds=[1236353663283495024])
+# Register commands instantly in these guilds (comma-separated ids); global when unset
+DEBUG_GUILDS = [int(guild_id) for guild_id in os.getenv('DEBUG_GUILDS', '').split(',') if guild_id.strip()]
 
-# Global variable to track current song
-current_song = {"title": None, "url": None, "url_stream": None, "start_time": None}
+# Every command works on a guild's state, so none of them are offered in DMs
+bot = discord.Bot(intents=intents, debug_guilds=DEBUG_GUILDS or None,
+                  default_command_contexts={discord.InteractionContextType.guild})
 
-# Queue to hold upcoming songs
-song_queue = []
+# Per-guild player, queue, recording and campaign state
+sessions = SessionManager()
 
-# Current position in the queue (index)
-queue_position = -1
+# Gauges read when /stats or the metrics endpoint asks for them
+metrics.registry.gauge('dnd_guild_sessions', 'Guilds with state in memory', lambda: len(sessions))
+metrics.registry.gauge('dnd_voice_connections', 'Connected voice clients', lambda: len(bot.voice_clients))
 
-# History of played songs (for /previous command)
-song_history = []
+# Minimum seconds between edits while a summary streams in
+SUMMARY_EDIT_INTERVAL = 1.5
 
-# Recording state
-is_recording = False
-recording_sink = None
-recording_start_time = None
+# Also keep a mixed mp3 of each session (exported in the background)
+ARCHIVE_RECORDINGS = os.getenv('ARCHIVE_RECORDINGS', '0') == '1'
+
+# Per-guild Whisper model size (guild id -> size)
+GUILD_SETTINGS_FILE = "guild_settings.json"
+try:
+    with open(GUILD_SETTINGS_FILE, "r") as f:
+        guild_model_sizes = json.load(f)
+except FileNotFoundError:
+    guild_model_sizes = {}
+# Serializes writes of GUILD_SETTINGS_FILE
+guild_settings_lock = asyncio.Lock()
+
+def model_size_for(guild_id):
+    """Whisper model size configured for a guild"""
+    return guild_model_sizes.get(str(guild_id), WHISPER_MODEL)
 
 async def play_next(ctx, direction="forward"):
     """Play the next (or previous) song in the queue
-    direction can be 'forward', 'backward', or 'jump' (when queue_position is already set)
+    direction can be 'forward', 'backward', or 'jump' (when queue.position is already set)
     """
-    global queue_position
     
-    if len(song_queue) == 0:
+    session = sessions.get(ctx.guild.id)
+    
+    if len(session.queue) == 0:
         print("Queue is empty")
         return
     
     # Add current song to history if moving forward
-    if direction == "forward" and current_song["title"] is not None:
-        song_history.append({
-            'url': current_song["url_stream"],
-            'title': current_song['title'],
-            'webpage_url': current_song['url']
-        })
+    if direction == "forward" and session.current_song["title"] is not None:
+        session.song_history.append(Track(
+            session.current_song['url'],
+            session.current_song['title'],
+            url=session.current_song["url_stream"]
+        ))
     
     # Determine which song to play
     if direction == "forward":
-        queue_position += 1
+        session.queue.advance()
     elif direction == "backward":
-        queue_position -= 1
-    # If direction is "jump", queue_position is already set
+        session.queue.rewind()
+    # If direction is "jump", queue.position is already set
+    
+    step = -1 if direction == "backward" else 1
+    while True:
+        # Check bounds
+        if session.queue.position < 0:
+            session.queue.position = 0
+        if session.queue.position >= len(session.queue):
+            print("Reached end of queue")
+            session.queue.position = len(session.queue) - 1
+            return
+        
+        next_song = session.queue[session.queue.position]
+        
+        cached = None
+        if not next_song.unavailable:
+            if session.prefetcher.ready_for(next_song):
+                break
+            
+            # Hot tracks play from the local audio cache without touching the network
+            cached = audio_cache.lookup(next_song.webpage_url)
+            if cached is not None:
+                next_song.duration = cached['duration']
+                break
+            
+            if OFFLINE_MODE:
+                print(f"Offline mode: {next_song.title} isn't cached, skipping")
+                next_song.mark_failed()
+        
+        # Resolve the stream URL just in time (cached until it's about to expire)
+        if not next_song.unavailable:
+            try:
+                info = await resolver.resolve(next_song.webpage_url)
+                next_song.url = info['url']
+                next_song.codec = info['codec']
+                next_song.title = info['title']
+                next_song.duration = info['duration']
+                next_song.failed_at = None
+                break
+            except Exception as e:
+                print(f"Could not resolve {next_song.title}: {e}")
+                next_song.mark_failed()
+        
+        # Skip tracks that can't be played
+        if session.queue.position + step < 0:
+            return
+        session.queue.position += step
     
-    # Check bounds
-    if queue_position < 0:
-        queue_position = 0
-    if queue_position >= len(song_queue):
-        print("Reached end of queue")
-        queue_position = len(song_queue) - 1
+    if ctx.voice_client is None:
         return
     
-    next_song = song_queue[queue_position]
-    
-    print(f"Playing position {queue_position + 1}: {next_song['title']}")
+    print(f"Playing position {session.queue.position + 1}: {next_song.title}")
     
     # Store current song info
-    current_song["title"] = next_song['title']
-    current_song["url"] = next_song['webpage_url']
-    current_song["url_stream"] = next_song['url']
-    current_song["start_time"] = time.time()
-    
-    # Play the audio
-    source = discord.FFmpegPCMAudio(next_song['url'], **FFMPEG_OPTIONS)
+    session.current_song["title"] = next_song.title
+    session.current_song["url"] = next_song.webpage_url
+    session.current_song["url_stream"] = next_song.url
+    session.current_song["start_time"] = time.time()
+    
+    # Play the audio (already buffering if it was prefetched)
+    source = session.prefetcher.take(next_song)
+    if source is None and cached is not None:
+        source = create_local_source(cached['file'])
+    if source is None:
+        source = await create_source(next_song.url, next_song.codec)
+    session.prefetcher.cancel()
     
     def after_playing(error):
-        finished_title = current_song['title']
+        finished_title = session.current_song['title']
         
         if error:
             print(f"Player error: {error}")
@@ -110,165 +172,272 @@ async def play_next(ctx, direction="forward"):
             print(f"Finished playing: {finished_title}")
             
         # Play next song in queue if available
-        import asyncio
-        if queue_position < len(song_queue) - 1 and ctx.voice_client:
+        if session.queue.has_next() and ctx.voice_client:
+            session.track_gaps.track_ended()
             asyncio.run_coroutine_threadsafe(play_next(ctx, "forward"), bot.loop)
         else:
             # Clear current song when queue ends
-            current_song["title"] = None
-            current_song["url"] = None
-            current_song["url_stream"] = None
-            current_song["start_time"] = None
+            session.clear_current_song()
     
     ctx.voice_client.play(source, after=after_playing)
     
-async def process_recording(ctx, audio_data, start_time):
-    """Process recorded audio: combine, transcribe, and summarize"""
+    gap = session.track_gaps.track_started()
+    if gap is not None:
+        print(f"Track transition gap: {gap * 1000:.0f}ms")
+    
+    # Keep a local copy so the next time this track plays it starts instantly
+    audio_cache.schedule_fill(next_song)
+    
+    # Get the following song ready shortly before this one ends
+    if session.queue.has_next():
+        duration = next_song.duration or 0
+        session.prefetcher.schedule(session.queue.peek_next(), duration - PREFETCH_LEAD_SECONDS)
+    
+# Live transcribers waiting for their job to run (recording dir -> LiveTranscriber)
+live_transcribers = {}
+
+async def process_recording(job):
+    """Take a recording job from its last checkpoint to a pinned summary
+    
+    Stages: transcribe each speaker and merge (checkpoint 'transcribed'),
+    summarize (checkpoint 'summarized'), post and pin ('done'), then fold the
+    summary into the campaign recap. The heavy lifting runs in the worker pool
+    so commands and music keep working. The spilled segment files are removed
+    once the summary is posted; if processing fails they're kept.
+    """
+    channel = bot.get_channel(job['channel_id']) or await bot.fetch_channel(job['channel_id'])
+    guild = bot.get_guild(job['guild_id'])
+    start_time = datetime.fromisoformat(job['started_at'])
+    session_date = start_time.strftime("%B %d, %Y at %I:%M %p")
+    campaign = campaign_key(job['guild_id'], job['campaign'])
+    
     try:
-        from pydub import AudioSegment
-        import io
-        
-        print(f"Processing recording with {len(audio_data)} audio streams")
-        print(f"User IDs in recording: {list(audio_data.keys())}")
-        
-        # Combine all audio streams
-        combined_audio = None
-        for user_id, audio in audio_data.items():
-            print(f"Processing audio from user {user_id}")
-            audio.file.seek(0)
-            # Try to detect format automatically
-            try:
-                audio_segment = AudioSegment.from_file(audio.file, format="mp3")
-            except:
-                audio.file.seek(0)
-                audio_segment = AudioSegment.from_file(audio.file, format="wav")
-            print(f"Audio segment duration: {len(audio_segment)}ms")
-            
-            if combined_audio is None:
-                combined_audio = audio_segment
-            else:
-                # Overlay all voices together
-                combined_audio = combined_audio.overlay(audio_segment)
-        
-        if combined_audio is None:
-            await ctx.send("❌ No audio to process!")
-            return
-        
-        # Save combined audio temporarily
-        timestamp = start_time.strftime("%Y%m%d_%H%M%S")
-        temp_file = f"recording_{timestamp}.mp3"
-        combined_audio.export(temp_file, format="mp3")
+        archive = None
+        transcript = job['transcript']
+        if job['stage'] == 'audio_saved':
+            timeline, archive = await transcribe_recording(channel, guild, job)
+            transcript = format_transcript(timeline)
+            # Keep the timed segments so past sessions can be searched
+            await transcript_store.save_session(campaign, job['started_at'], timeline)
+            await jobs.checkpoint(job['id'], 'transcribed', transcript=transcript)
         
-        await ctx.send("🎧 Audio combined. Starting transcription... (this will take a while)")
-
-        # Convert MP3 to WAV for Whisper (it works better with WAV)
-        wav_file = temp_file.replace('.mp3', '.wav')
-        combined_audio.export(wav_file, format="wav")
+        summary = job['summary']
+        message = None
+        if summary is None:
+            summary, message = await generate_summary(channel, transcript, session_date, job)
+            await jobs.checkpoint(job['id'], 'summarized', summary=summary)
         
-        print(f"Exported audio file: {wav_file}")
-        print(f"File size: {os.path.getsize(wav_file)} bytes")
+        await post_summary(channel, message, session_date, summary)
+        await jobs.checkpoint(job['id'], 'done')
         
-        # Transcribe using Whisper
-        model = whisper.load_model("base")
-        print("Whisper model loaded, starting transcription...")
-        result = model.transcribe(wav_file)
+        # The archive reads the segment files, so let it finish before removing them
+        if archive is not None:
+            await archive
+        discard_recording(job['recording_dir'])
         
-        transcript = result["text"]
-        print(f"Transcript length: {len(transcript)} characters")
-        print(f"Transcript preview: {transcript[:200]}")
+        # Only after posting: the recap is another full LLM generation
+        await update_campaign_recap(job['guild_id'], job['campaign'])
         
-        await ctx.send("✅ Transcription complete! Generating summary...")
+    except Exception as e:
+        await channel.send(f"❌ Error processing recording: {str(e)}")
+        print(f"Processing error: {e} (audio kept in {job['recording_dir']})")
+        raise
+
+async def transcribe_recording(channel, guild, job):
+    """Merged timeline for a job; returns (timeline, archive task or None)
+    
+    If the session was recorded live, most of the transcript already exists and
+    only the last window (and any live window that failed) needs transcribing.
+    After a restart the live results are gone, so then the recording is
+    transcribed from the segment files instead.
+    """
+    # Segment file paths per speaker; workers read the audio themselves
+    streams, offsets = load_recording(job['recording_dir'])
+    char_map = load_char_map(job['guild_id'], job['campaign'])
+    
+    live = live_transcribers.pop(job['recording_dir'], None)
+    if live is not None:
+        per_user = await live.finish()
+        print(f"Live transcript finished after {live.windows_done} window(s), "
+              f"{live.windows_failed} redone from the segment files")
+        return build_timeline(guild, per_user, char_map), start_archive(job, streams, offsets)
+    
+    print(f"Processing recording with {len(streams)} audio streams")
+    print(f"User IDs in recording: {list(streams.keys())}")
+    
+    await channel.send(f"🎧 Transcribing {len(streams)} speaker(s) in parallel... (this will take a while)")
+    
+    # Transcribe every speaker separately so crosstalk doesn't garble the text
+    results = await asyncio.gather(*[
+        transcription_pool.run(transcribe_speaker, paths, job['model_size']) for paths in streams.values()
+    ])
+    
+    archive = start_archive(job, streams, offsets)
+    
+    per_user = {}
+    for user_id, result in zip(streams.keys(), results):
+        print(f"User {user_id}: {len(result['segments'])} segment(s)")
+        # Each stream starts at that speaker's first packet, not at the start of the session
+        per_user[user_id] = shift_segments(result['segments'], offsets[user_id])
+        if result['duration'] > 0:
+            metrics.transcription_rtf.observe(result['processing_time'] / result['duration'], mode='batch')
+    
+    # Report how much silence voice activity detection skipped
+    total = sum(result['duration'] for result in results)
+    speech = sum(result['speech_duration'] for result in results)
+    if total > 0 and speech < total:
+        skipped = total - speech
+        await channel.send(f"⏩ Skipped {skipped / 60:.1f} of {total / 60:.1f} minutes of silence "
+                           f"({skipped / total:.0%})")
+    
+    return build_timeline(guild, per_user, char_map), archive
+
+def build_timeline(guild, per_user, char_map):
+    """Label each user's segments with their character and merge them into one timeline"""
+    per_speaker = {}
+    for user_id, segments in per_user.items():
+        per_speaker.setdefault(speaker_name(guild, char_map, user_id), []).extend(segments)
+    return merge_speaker_segments(per_speaker)
 
-        print(f"Sending transcript to Ollama: {transcript}")
+def start_archive(job, streams, offsets):
+    """Start exporting the session mp3 if ARCHIVE_RECORDINGS is on; returns the task or None"""
+    if not ARCHIVE_RECORDINGS:
+        return None
+    timestamp = datetime.fromisoformat(job['started_at']).strftime("%Y%m%d_%H%M%S")
+    return asyncio.create_task(archive_recording(streams, offsets, f"recording_{timestamp}"))
+
+async def archive_recording(streams, offsets, basename):
+    """Export the mixed session mp3 without holding up the summary"""
+    try:
+        mp3_file = await transcription_pool.run(mix_recording, streams, offsets, basename)
+        print(f"Archived recording: {mp3_file}")
+    except Exception as e:
+        print(f"Archive error: {e}")
+
+async def generate_summary(channel, transcript, session_date, job):
+    """Summarize a finished transcript, streaming it into a new message; returns (summary, message)
+    
+    A transcript that was summarized before with the same characters, prompts
+    and model reuses that summary (message is None then).
+    """
+    print(f"Transcript length: {len(transcript)} characters")
+    print(f"Transcript preview: {transcript[:200]}")
+    
+    # Load character mappings from the campaign that was active when recording stopped
+    char_context = build_char_context(load_char_map(job['guild_id'], job['campaign']))
+    transcript_hash = content_hash(transcript, char_context)
+    campaign = campaign_key(job['guild_id'], job['campaign'])
+    
+    summary = summary_store.cached_summary(transcript_hash, PROMPT_VERSION, OLLAMA_MODEL)
+    if summary is not None:
+        await channel.send("✅ Transcription complete! This session was summarized before, reusing that summary.")
+        await summary_store.save_summary(campaign, job['started_at'], transcript_hash, PROMPT_VERSION,
+                                         OLLAMA_MODEL, summary)
+        return summary, None
+    
+    await channel.send("✅ Transcription complete! Generating summary...")
+
+    print(f"Sending transcript to Ollama: {transcript}")
+    
+    # Post the summary right away and fill it in as tokens stream from Ollama
+    message = await channel.send(format_summary(session_date, "*✍️ Writing summary...*"))
+    last_edit = 0
+    
+    async def on_token(text):
+        nonlocal last_edit
+        # Stay well under Discord's edit rate limit
+        if time.monotonic() - last_edit >= SUMMARY_EDIT_INTERVAL:
+            last_edit = time.monotonic()
+            await message.edit(content=format_summary(session_date, text + " ▌"))
+    
+    # Summarize using Ollama (long transcripts are summarized in chunks, then combined)
+    summary, timings = await summarize_transcript(transcript, char_context, on_token=on_token)
+    print("Summary timings: " + ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in timings.items()))
+    
+    await summary_store.save_summary(campaign, job['started_at'], transcript_hash, PROMPT_VERSION,
+                                     OLLAMA_MODEL, summary)
+    return summary, message
+
+# One recap update per campaign at a time, so no session is folded in twice
+recap_locks = {}
+
+async def update_campaign_recap(guild_id, name):
+    """Fold sessions that aren't in the campaign's "story so far" yet into it, oldest first
+    
+    Only the previous recap and each new summary go to the LLM, never older
+    transcripts. A failure is only reported; the session is picked up again
+    the next time the recap is updated.
+    """
+    campaign = campaign_key(guild_id, name)
+    lock = recap_locks.setdefault(campaign, asyncio.Lock())
+    async with lock:
+        pending = summary_store.pending_for_recap(campaign)
+        if not pending:
+            return
         
-        # Load character mappings from active campaign
-        filename = f"campaign_{active_character_map}.json"
+        existing = summary_store.recap(campaign)
+        recap = existing['recap'] if existing else None
+        char_context = build_char_context(load_char_map(guild_id, name))
         try:
-            with open(filename, "r") as f:
-                char_map = json.load(f)
-            
-            # Create character context for the AI
-            char_context = "Character Names:\n"
-            for user_id, info in char_map.items():
-                char_context += f"- {info['character_info']}\n"
-        except FileNotFoundError:
-            char_context = "No character information available."
-        
-        # Summarize using Ollama
-        summary_prompt = f"""You are summarizing a D&D session transcript. Extract only the KEY EVENTS and DECISIONS.
-
-{char_context}
-
-Transcript:
-{transcript}
-
-When summarizing, use the character names provided above instead of generic terms like "the party" or "someone". 
-
-Provide a concise summary with:
-1. Major story events that happened
-2. Important decisions the party made (mention which characters made key decisions)
-3. Key NPCs encountered
-4. Loot or rewards obtained (mention who got what if specified)
-5. Next session hooks/cliffhangers
-
-Keep it brief - focus only on what matters for continuity."""
-
-        # Call Ollama API
-        response = requests.post(
-            'http://localhost:11434/api/generate',
-            json={
-                'model': 'llama3.2',
-                'prompt': summary_prompt,
-                'stream': False
-            }
-        )
-        
-        summary = response.json()['response']
-        
-        # Format the output
-        session_date = start_time.strftime("%B %d, %Y at %I:%M %p")
-        output = f"""# D&D Session Summary
+            for entry in pending:
+                session_date = datetime.fromisoformat(entry['started_at']).strftime("%B %d, %Y")
+                recap = await update_recap(recap, entry['summary'], session_date, char_context)
+                await summary_store.save_recap(campaign, recap, entry['started_at'])
+            print(f"Campaign recap for '{name}' updated with {len(pending)} session(s)")
+        except Exception as e:
+            print(f"Recap update failed for '{name}': {e}")
+
+async def post_summary(channel, message, session_date, summary):
+    """Put the finished summary in its message (or a new one when resuming) and pin it"""
+    # Send to Discord (we'll add Google Sheets option later)
+    if message is None:
+        message = await channel.send(format_summary(session_date, summary))
+    else:
+        await message.edit(content=format_summary(session_date, summary))
+    await message.pin()
+    
+    await channel.send("📌 Session summary has been pinned!")
+
+def format_summary(session_date, summary):
+    """Session summary message, trimmed to Discord's 2000 character limit"""
+    output = f"""# D&D Session Summary
 **Date:** {session_date}
 
 ## Key Events & Decisions
 {summary}
 
 ---
-*Full transcript available upon request*
+*Search the full transcript with `/searchsessions`*
 """
-        
-        # Send to Discord (we'll add Google Sheets option later)
-        message = await ctx.send(output)
-        await message.pin()
-        
-        await ctx.send("📌 Session summary has been pinned!")
-        
-        # Clean up temp file
-        os.remove(temp_file)
-        os.remove(wav_file)
-        
-    except Exception as e:
-        await ctx.send(f"❌ Error processing recording: {str(e)}")
-        print(f"Processing error: {e}")
-        
-# Global variable to track active character map
-active_character_map = "default"
+    return output[:2000]
+    
+def load_char_map(guild_id, campaign):
+    """Character mappings for a guild's campaign (empty if it doesn't exist)"""
+    try:
+        return campaigns.get(guild_id, campaign)
+    except FileNotFoundError:
+        return {}
+
+def speaker_name(guild, char_map, user_id):
+    """Character name for a recorded user, falling back to their Discord name"""
+    info = char_map.get(str(user_id))
+    if info:
+        return info['character_info']
+    
+    member = guild.get_member(user_id) if guild else None
+    if member:
+        return member.display_name
+    return f"Player {user_id}"
 
 @bot.slash_command(name="createcampaign", description="Create a new campaign character mapping")
 async def createcampaign(ctx, campaign_name: str):
     """Create a new character mapping file for a campaign"""
     
-    filename = f"campaign_{campaign_name}.json"
-    
-    # Check if it already exists
-    if os.path.exists(filename):
+    # Create empty mapping (fails if it already exists)
+    if not await campaigns.create(ctx.guild.id, campaign_name):
         await ctx.respond(f"❌ Campaign '{campaign_name}' already exists! Use `/loadcampaign` to switch to it.")
         return
     
-    # Create empty mapping file
-    with open(filename, "w") as f:
-        json.dump({}, f, indent=2)
-    
     await ctx.respond(f"✅ **Campaign created:** {campaign_name}\n"
                      f"Use `/loadcampaign {campaign_name}` to activate it, then `/addcharacter` to add players.")
 
@@ -276,19 +445,16 @@ async def createcampaign(ctx, campaign_name: str):
 async def loadcampaign(ctx, campaign_name: str):
     """Switch to a different campaign's character mappings"""
     
-    global active_character_map
-    
-    filename = f"campaign_{campaign_name}.json"
+    session = sessions.get(ctx.guild.id)
     
-    if not os.path.exists(filename):
+    if not campaigns.exists(ctx.guild.id, campaign_name):
         await ctx.respond(f"❌ Campaign '{campaign_name}' doesn't exist! Use `/createcampaign` to create it.")
         return
     
-    active_character_map = campaign_name
+    session.active_character_map = campaign_name
     
     # Show current characters in this campaign
-    with open(filename, "r") as f:
-        char_map = json.load(f)
+    char_map = campaigns.get(ctx.guild.id, campaign_name)
     
     if char_map:
         char_list = "\n".join([f"- {info['character_info']}" for info in char_map.values()])
@@ -298,100 +464,182 @@ async def loadcampaign(ctx, campaign_name: str):
 
 @bot.slash_command(name="listcampaigns", description="Show all available campaigns")
 async def listcampaigns(ctx):
-    """List all campaign files"""
+    """List all campaigns (from the index built at startup)"""
+    
+    session = sessions.get(ctx.guild.id)
     
-    campaign_files = [f for f in os.listdir('.') if f.startswith('campaign_') and f.endswith('.json')]
+    campaign_names = campaigns.names(ctx.guild.id)
     
-    if not campaign_files:
+    if not campaign_names:
         await ctx.respond("No campaigns created yet! Use `/createcampaign` to create one.")
         return
     
-    campaigns = [f.replace('campaign_', '').replace('.json', '') for f in campaign_files]
-    current_marker = " ← **ACTIVE**" if active_character_map in campaigns else ""
+    current_marker = " ← **ACTIVE**" if session.active_character_map in campaign_names else ""
     
-    campaign_list = "\n".join([f"• {c}{current_marker if c == active_character_map else ''}" for c in campaigns])
+    campaign_list = "\n".join([f"• {c}{current_marker if c == session.active_character_map else ''}" for c in campaign_names])
     
     await ctx.respond(f"📋 **Available Campaigns:**\n{campaign_list}\n\n"
-                     f"Current: **{active_character_map}**\n"
+                     f"Current: **{session.active_character_map}**\n"
                      f"Use `/loadcampaign name` to switch.")
 
 @bot.slash_command(name="addcharacter", description="Add a character to the active campaign")
 async def addcharacter(ctx, player: discord.Member, character_info: str):
     """Map a Discord user to their character name in the active campaign"""
     
-    filename = f"campaign_{active_character_map}.json"
+    session = sessions.get(ctx.guild.id)
     
-    # Load existing mappings
+    # Add new mapping (saved to disk in the background)
     try:
-        with open(filename, "r") as f:
-            char_map = json.load(f)
+        async with campaigns.edit(ctx.guild.id, session.active_character_map) as char_map:
+            char_map[str(player.id)] = {
+                "discord_name": player.display_name,
+                "character_info": character_info
+            }
     except FileNotFoundError:
         await ctx.respond(f"❌ No campaign loaded! Use `/createcampaign` or `/loadcampaign` first.")
         return
     
-    # Add new mapping
-    char_map[str(player.id)] = {
-        "discord_name": player.display_name,
-        "character_info": character_info
-    }
-    
-    # Save mappings
-    with open(filename, "w") as f:
-        json.dump(char_map, f, indent=2)
-    
-    await ctx.respond(f"✅ **Character added to '{active_character_map}':**\n"
+    await ctx.respond(f"✅ **Character added to '{session.active_character_map}':**\n"
                      f"{player.display_name} → {character_info}")
 
 @bot.slash_command(name="showcharacters", description="Show characters in the active campaign")
 async def showcharacters(ctx):
     """Display all character mappings for the active campaign"""
     
-    filename = f"campaign_{active_character_map}.json"
+    session = sessions.get(ctx.guild.id)
     
     try:
-        with open(filename, "r") as f:
-            char_map = json.load(f)
+        char_map = campaigns.get(ctx.guild.id, session.active_character_map)
         
         if not char_map:
-            await ctx.respond(f"No characters in campaign '{active_character_map}' yet! Use `/addcharacter` to add players.")
+            await ctx.respond(f"No characters in campaign '{session.active_character_map}' yet! Use `/addcharacter` to add players.")
             return
         
-        message = f"👥 **Party Roster** (Campaign: {active_character_map}):\n\n"
+        message = f"👥 **Party Roster** (Campaign: {session.active_character_map}):\n\n"
         for user_id, info in char_map.items():
             message += f"**{info['character_info']}**\n└ Played by: {info['discord_name']}\n\n"
         
         await ctx.respond(message)
         
     except FileNotFoundError:
-        await ctx.respond(f"❌ Campaign '{active_character_map}' not found! Use `/createcampaign` first.")
+        await ctx.respond(f"❌ Campaign '{session.active_character_map}' not found! Use `/createcampaign` first.")
 
 @bot.slash_command(name="removecharacter", description="Remove a character from the active campaign")
 async def removecharacter(ctx, player: discord.Member):
     """Remove a player's character mapping from the active campaign"""
     
-    filename = f"campaign_{active_character_map}.json"
+    session = sessions.get(ctx.guild.id)
     
     try:
-        with open(filename, "r") as f:
-            char_map = json.load(f)
+        async with campaigns.edit(ctx.guild.id, session.active_character_map) as char_map:
+            removed = char_map.pop(str(player.id), None)
         
-        user_id = str(player.id)
-        if user_id in char_map:
-            removed = char_map.pop(user_id)
-            
-            with open(filename, "w") as f:
-                json.dump(char_map, f, indent=2)
-            
-            await ctx.respond(f"✅ Removed from '{active_character_map}': {removed['character_info']}")
+        if removed is not None:
+            await ctx.respond(f"✅ Removed from '{session.active_character_map}': {removed['character_info']}")
         else:
-            await ctx.respond(f"No character found for {player.display_name} in campaign '{active_character_map}'")
+            await ctx.respond(f"No character found for {player.display_name} in campaign '{session.active_character_map}'")
             
     except FileNotFoundError:
-        await ctx.respond(f"❌ Campaign '{active_character_map}' not found!")
+        await ctx.respond(f"❌ Campaign '{session.active_character_map}' not found!")
+
+# Background task that drops idle guild state
+session_sweeper = None
+# Set once every background service is up; on_ready fires again after reconnects
+services_started = False
+
+# When each in-flight slash command started (interaction id -> perf_counter)
+command_started = {}
+
+@bot.listen()
+async def on_application_command(ctx):
+    command_started[ctx.interaction.id] = time.perf_counter()
+
+def record_command(ctx):
+    started = command_started.pop(ctx.interaction.id, None)
+    if started is not None:
+        metrics.command_seconds.observe(time.perf_counter() - started, command=ctx.command.qualified_name)
+
+@bot.listen()
+async def on_application_command_completion(ctx):
+    record_command(ctx)
+
+@bot.listen()
+async def on_application_command_error(ctx, error):
+    record_command(ctx)
+    metrics.command_errors.inc(command=ctx.command.qualified_name)
+    # Registering a listener replaces py-cord's default error printout
+    traceback.print_exception(type(error), error, error.__traceback__)
+
+def guild_in_voice(guild_id):
+    """Guilds still connected to voice keep their state even when idle"""
+    guild = bot.get_guild(guild_id)
+    return guild is not None and guild.voice_client is not None
+
+async def recover_recordings():
+    """Queue recordings a crash left on disk before any job was submitted for them"""
+    known = {os.path.abspath(path) for path in jobs.recording_dirs()}
+    recording = {os.path.abspath(session.recording_sink.directory)
+                 for session in sessions.all() if session.recording_sink is not None}
+    for directory, info in find_recordings():
+        path = os.path.abspath(directory)
+        if path in known or path in recording:
+            continue
+        if info.get('guild_id') is None or info.get('channel_id') is None:
+            print(f"Recording {directory} doesn't say which guild it's from, leaving it alone")
+            continue
+        if not load_recording(directory)[0]:
+            discard_recording(directory)
+            continue
+        job_id = await jobs.submit(info['guild_id'], info['channel_id'], directory, info['started'],
+                                   info.get('campaign') or "default", info.get('model_size') or WHISPER_MODEL)
+        print(f"Recovered unprocessed recording {directory} as job #{job_id}")
 
 @bot.event
 async def on_ready():
     print(f'{bot.user} has connected to Discord!')
+    
+    global session_sweeper, services_started
+    if services_started:
+        return
+    
+    # Recording jobs come first so nothing optional below can keep them from running;
+    # this picks up recordings that were still being processed when the bot stopped
+    await jobs.start(process_recording)
+    await recover_recordings()
+    # Spawn the transcription workers now; each loads the model as it starts
+    transcription_pool.start()
+    
+    if session_sweeper is None:
+        session_sweeper = asyncio.create_task(sessions.run_evictions(guild_in_voice))
+        # Check cached audio files against their hashes
+        asyncio.create_task(asyncio.to_thread(audio_cache.verify))
+        asyncio.create_task(metrics.monitor_loop_lag())
+    try:
+        await metrics.start_http_server()
+    except Exception as e:
+        print(f"Metrics server not started: {e}")
+    services_started = True
+
+@bot.slash_command(name="whispermodel", description="Set the Whisper model size used for this server")
+@discord.default_permissions(manage_guild=True)
+async def whispermodel(ctx, size: discord.Option(str, choices=MODEL_SIZES)):
+    """Pick tiny/base/small transcription for this guild"""
+    
+    async with guild_settings_lock:
+        guild_model_sizes[str(ctx.guild.id)] = size
+        await asyncio.to_thread(write_atomic, GUILD_SETTINGS_FILE, json.dumps(guild_model_sizes, indent=2))
+    
+    await ctx.respond(f"✅ Transcription will use the **{size}** Whisper model.")
+
+@bot.slash_command(name="stats", description="Show latency and resource metrics (admins)")
+@discord.default_permissions(administrator=True)
+async def stats(ctx):
+    """Where the time goes: commands, resolving, FFmpeg, gaps, transcription, LLM, event loop"""
+    text = metrics.format_stats() or "No metrics recorded yet."
+    # Keep within Discord's message limit
+    if len(text) > 1900:
+        text = text[:1900] + "\n…"
+    await ctx.respond(f"```\n{text}\n```", ephemeral=True)
 
 @bot.slash_command(name="hello", description="Test command")
 async def hello(ctx):
@@ -399,6 +647,8 @@ async def hello(ctx):
 
 @bot.slash_command(name="join", description="Join your voice channel")
 async def join(ctx):
+    sessions.get(ctx.guild.id)
+    
     if ctx.author.voice is None:
         await ctx.respond("You need to be in a voice channel!")
         return
@@ -412,10 +662,13 @@ async def join(ctx):
 
 @bot.slash_command(name="leave", description="Leave the voice channel")
 async def leave(ctx):
+    session = sessions.get(ctx.guild.id)
+    
     if ctx.voice_client is None:
         await ctx.respond("I'm not in a voice channel!")
         return
     
+    session.prefetcher.cancel()
     await ctx.voice_client.disconnect()
     await ctx.respond("Left the voice channel!")
     
@@ -445,6 +698,8 @@ async def testplay(ctx):
     
 @bot.slash_command(name="play", description="Play audio from a YouTube URL")
 async def play(ctx, url: str):
+    session = sessions.get(ctx.guild.id)
+    
     # Check if user is in voice channel
     if ctx.author.voice is None:
         await ctx.respond("You need to be in a voice channel!")
@@ -461,187 +716,211 @@ async def play(ctx, url: str):
     
     await ctx.respond(f"🎵 Loading audio from: {url}")
     
-    # Extract audio info
-    with yt_dlp.YoutubeDL(YTDL_OPTIONS) as ydl:
-        try:
-            print(f"Extracting info from: {url}")
-            info = ydl.extract_info(url, download=False)
+    try:
+        # Hot tracks play from the local audio cache without touching the network
+        cached = audio_cache.lookup(url)
+        if cached is not None:
+            url2 = None
+            title = cached['title']
+        elif OFFLINE_MODE:
+            await ctx.respond("❌ Offline mode: this track isn't in the audio cache")
+            return
+        else:
+            # Extract audio info (off the event loop, cached)
+            info = await resolver.resolve(url)
             url2 = info['url']
-            title = info.get('title', 'Unknown')
-            
-            print(f"Playing: {title}")
+            title = info['title']
             print(f"Stream URL: {url2[:100]}...")  # Print first 100 chars of stream URL
+        
+        print(f"Playing: {title}")
+        
+        # Store current song info
+        session.current_song["title"] = title
+        session.current_song["url"] = url
+        session.current_song["url_stream"] = url2
+        session.current_song["start_time"] = time.time()
+        
+        # Play the audio
+        if cached is not None:
+            source = create_local_source(cached['file'])
+        else:
+            source = await create_source(url2, info['codec'])
+            # Keep a local copy so the next time this track plays it starts instantly
+            audio_cache.schedule_fill(Track(url, title, url=url2, codec=info['codec'], duration=info['duration']))
+        
+        def after_playing(error):
+            # Capture the title before clearing
+            finished_title = session.current_song['title']
             
-            # Store current song info
-            current_song["title"] = title
-            current_song["url"] = url
-            current_song["url_stream"] = url2
-            current_song["start_time"] = time.time()
-            
-            # Play the audio
-            source = discord.FFmpegPCMAudio(url2, **FFMPEG_OPTIONS)
-            
-            def after_playing(error):
-                # Capture the title before clearing
-                finished_title = current_song['title']
-                
-                # Clear current song info when done
-                current_song["title"] = None
-                current_song["url"] = None
-                current_song["url_stream"] = None
-                current_song["start_time"] = None
-                
-                if error:
-                    print(f"Player error: {error}")
-                else:
-                    print(f"Finished playing: {finished_title}")
-            
-            ctx.voice_client.play(source, after=after_playing)
+            # Clear current song info when done
+            session.clear_current_song()
             
-            await ctx.respond(f"▶️ Now playing: **{title}**")
-        except Exception as e:
-            print(f"Error: {e}")
-            await ctx.respond(f"❌ Error playing audio: {str(e)}")
+            if error:
+                print(f"Player error: {error}")
+            else:
+                print(f"Finished playing: {finished_title}")
+        
+        ctx.voice_client.play(source, after=after_playing)
+        
+        await ctx.respond(f"▶️ Now playing: **{title}**")
+    except Exception as e:
+        print(f"Error: {e}")
+        await ctx.respond(f"❌ Error playing audio: {str(e)}")
             
 @bot.slash_command(name="queue", description="Add a song to the queue")
 async def queue_song(ctx, url: str):
+    session = sessions.get(ctx.guild.id)
+    
     await ctx.respond(f"🔍 Adding to queue: {url}")
     
-    # Extract song info
-    with yt_dlp.YoutubeDL(YTDL_OPTIONS) as ydl:
-        try:
-            info = ydl.extract_info(url, download=False)
-            song_info = {
-                'url': info['url'],
-                'title': info.get('title', 'Unknown'),
-                'webpage_url': url
-            }
-            song_queue.append(song_info)
-            
-            position = len(song_queue)
-            await ctx.respond(f"✅ Added to queue (#{position}): **{song_info['title']}**")
+    try:
+        # Cached tracks already have their title and duration; play_next plays the local file
+        cached = audio_cache.lookup(url)
+        metadata = resolver.metadata(url)
+        if cached is not None:
+            song_info = Track(url, cached['title'], duration=cached['duration'])
+        elif OFFLINE_MODE:
+            await ctx.respond("❌ Offline mode: this track isn't in the audio cache")
+            return
+        elif metadata is not None:
+            # Looked up before: queue it right away, play_next resolves the stream just in time
+            song_info = Track(url, metadata['title'], duration=metadata['duration'])
+        else:
+            # Extract song info (off the event loop, cached)
+            info = await resolver.resolve(url)
+            song_info = Track(url, info['title'], url=info['url'], codec=info['codec'], duration=info['duration'])
+        session.queue.append(song_info)
+        
+        position = len(session.queue)
+        await ctx.respond(f"✅ Added to queue (#{position}): **{song_info.title}**")
+        
+        # If nothing is playing, start playing
+        if ctx.voice_client and not ctx.voice_client.is_playing():
+            if len(session.queue) == 1:  # First song added
+                session.queue.position = -1  # Will become 0 when play_next increments
+            await play_next(ctx, "forward")
             
-            # If nothing is playing, start playing
-            if ctx.voice_client and not ctx.voice_client.is_playing():
-                global queue_position
-                if len(song_queue) == 1:  # First song added
-                    queue_position = -1  # Will become 0 when play_next increments
-                await play_next(ctx, "forward")
-                
-        except Exception as e:
-            print(f"Error adding to queue: {e}")
-            await ctx.respond(f"❌ Error adding to queue: {str(e)}")
+    except Exception as e:
+        print(f"Error adding to queue: {e}")
+        await ctx.respond(f"❌ Error adding to queue: {str(e)}")
             
 @bot.slash_command(name="playlist", description="Add all songs from a YouTube/YouTube Music playlist to queue")
 async def playlist(ctx, url: str):
-    await ctx.respond(f"🔍 Fetching playlist from: {url}")
+    session = sessions.get(ctx.guild.id)
     
-    # Special options for playlists
-    playlist_opts = YTDL_OPTIONS.copy()
-    playlist_opts['noplaylist'] = False
-    playlist_opts['extract_flat'] = True  # Don't download, just get URLs
+    await ctx.respond(f"🔍 Fetching playlist from: {url}")
     
-    with yt_dlp.YoutubeDL(playlist_opts) as ydl:
-        try:
-            print(f"Extracting playlist info from: {url}")
-            playlist_info = ydl.extract_info(url, download=False)
-            
-            if 'entries' not in playlist_info:
-                await ctx.respond("❌ This doesn't appear to be a playlist!")
-                return
-            
-            entries = playlist_info['entries']
-            playlist_title = playlist_info.get('title', 'Unknown Playlist')
-            
-            await ctx.respond(f"📋 Found playlist: **{playlist_title}** ({len(entries)} songs)\n⏳ Adding to queue...")
-            
-            added_count = 0
-            for entry in entries:
-                if entry is None:
-                    continue
-                
-                try:
-                    # Get full info for each song
-                    video_url = f"https://www.youtube.com/watch?v={entry['id']}"
-                    song_info_detailed = ydl.extract_info(video_url, download=False)
-                    
-                    song_info = {
-                        'url': song_info_detailed['url'],
-                        'title': song_info_detailed.get('title', 'Unknown'),
-                        'webpage_url': video_url
-                    }
-                    song_queue.append(song_info)
-                    added_count += 1
-                    print(f"Added to queue: {song_info['title']}")
-                    
-                except Exception as e:
-                    print(f"Skipped a song due to error: {e}")
-                    continue
-            
-            await ctx.respond(f"✅ Added {added_count} songs from **{playlist_title}** to the queue!")
+    try:
+        print(f"Extracting playlist info from: {url}")
+        playlist_info = await resolver.extract_playlist(url)
+        
+        if 'entries' not in playlist_info:
+            await ctx.edit(content="❌ This doesn't appear to be a playlist!")
+            return
+        
+        entries = [entry for entry in playlist_info['entries'] if entry is not None]
+        playlist_title = playlist_info.get('title', 'Unknown Playlist')
+        
+        # Queue everything right away from the flat metadata; streams resolve later
+        songs = []
+        for entry in entries:
+            songs.append(Track(f"https://www.youtube.com/watch?v={entry['id']}",
+                               entry.get('title') or 'Unknown',
+                               duration=entry.get('duration')))
+        session.queue.extend(songs)
+        
+        await ctx.edit(content=f"📋 **{playlist_title}**: added {len(songs)} songs to the queue")
+        
+        # If not in voice, just notify user
+        if ctx.voice_client is None:
+            await ctx.respond("💡 Use `/join` to have the bot auto-play, or it will start when you manually join it to a voice channel!")
+        elif not ctx.voice_client.is_playing():
+            # If nothing is playing, start playing (play_next resolves the first track)
+            await play_next(ctx)
+        
+        asyncio.create_task(resolve_playlist(ctx, songs, playlist_title))
             
-            # If not in voice, just notify user
-            if ctx.voice_client is None:
-                await ctx.respond("💡 Use `/join` to have the bot auto-play, or it will start when you manually join it to a voice channel!")
-                return
-
-            # If nothing is playing, start playing
-            if not ctx.voice_client.is_playing():
-                await play_next(ctx)
-                
-        except Exception as e:
-            print(f"Error loading playlist: {e}")
-            await ctx.respond(f"❌ Error loading playlist: {str(e)}")
+    except Exception as e:
+        print(f"Error loading playlist: {e}")
+        await ctx.edit(content=f"❌ Error loading playlist: {str(e)}")
+
+async def resolve_playlist(ctx, songs, playlist_title):
+    """Fill in titles for queued playlist songs in the background, editing one progress message"""
+    semaphore = asyncio.Semaphore(PLAYLIST_RESOLVE_CONCURRENCY)
+    done = 0
+    failed = 0
+    last_edit = time.monotonic()
+    
+    async def resolve_song(song_info):
+        nonlocal done, failed, last_edit
+        async with semaphore:
+            try:
+                info = await resolver.resolve(song_info.webpage_url)
+                song_info.title = info['title']
+                song_info.duration = info['duration']
+            except Exception as e:
+                print(f"Skipped a song due to error: {e}")
+                song_info.mark_failed()
+                failed += 1
+        done += 1
+        
+        if time.monotonic() - last_edit >= 2:
+            last_edit = time.monotonic()
+            try:
+                await ctx.edit(content=f"📋 **{playlist_title}**: added {len(songs)} songs to the queue "
+                                       f"(⏳ checked {done}/{len(songs)})")
+            except discord.HTTPException as e:
+                print(f"Could not update playlist progress: {e}")
+    
+    await asyncio.gather(*[resolve_song(song_info) for song_info in songs])
+    
+    unavailable = f", {failed} unavailable" if failed else ""
+    await ctx.edit(content=f"✅ Added {len(songs)} songs from **{playlist_title}** to the queue!{unavailable}")
             
 @bot.slash_command(name="playnum", description="Play a specific song from the queue by number")
 async def playnum(ctx, number: int):
+    session = sessions.get(ctx.guild.id)
+    
     if ctx.voice_client is None:
         await ctx.respond("I'm not in a voice channel!")
         return
     
-    if len(song_queue) == 0:
+    if len(session.queue) == 0:
         await ctx.respond("Queue is empty!")
         return
     
-    if number < 1 or number > len(song_queue):
-        await ctx.respond(f"Invalid number! Queue has {len(song_queue)} songs.")
+    if number < 1 or number > len(session.queue):
+        await ctx.respond(f"Invalid number! Queue has {len(session.queue)} songs.")
         return
     
-    global queue_position
-    queue_position = number - 2  # Will be incremented to number-1 by play_next
+    session.queue.position = number - 2  # Will be incremented to number-1 by play_next
     
     # Stop current playback
     if ctx.voice_client.is_playing():
         ctx.voice_client.stop()
     
     # Jump to selected position
-    queue_position = number - 1  # Direct set for jump
+    session.queue.jump(number - 1)  # Direct set for jump
     await play_next(ctx, "jump")
     
-    await ctx.respond(f"🎵 Jumping to #{number}: **{song_queue[number-1]['title']}**")
+    await ctx.respond(f"🎵 Jumping to #{number}: **{session.queue[number-1].title}**")
             
 @bot.slash_command(name="showqueue", description="Show the current song queue")
 async def showqueue(ctx):
-    if len(song_queue) == 0:
+    session = sessions.get(ctx.guild.id)
+    
+    if len(session.queue) == 0:
         await ctx.respond("Queue is empty!")
         return
     
-    message = f"📋 **Queue ({len(song_queue)} song(s)):**\n\n"
-    
-    for i, song in enumerate(song_queue):
-        # Highlight currently playing song
-        if i == queue_position and current_song["title"]:
-            elapsed = int(time.time() - current_song["start_time"])
-            minutes = elapsed // 60
-            seconds = elapsed % 60
-            message += f"▶️ **{i + 1}. {song['title']}** ({minutes}:{seconds:02d})\n"
-        else:
-            message += f"{i + 1}. {song['title']}\n"
-    
-    await ctx.respond(message)
+    # Start on the page with the current song; buttons page through the rest
+    page = current_page(session)
+    await ctx.respond(render_page(session, page), view=QueueView(session, page))
     
 @bot.slash_command(name="skip", description="Skip to the next song")
 async def skip(ctx):
+    session = sessions.get(ctx.guild.id)
+    
     if ctx.voice_client is None:
         await ctx.respond("I'm not in a voice channel!")
         return
@@ -650,32 +929,32 @@ async def skip(ctx):
         await ctx.respond("Nothing is playing!")
         return
     
-    if queue_position >= len(song_queue) - 1:
+    if not session.queue.has_next():
         await ctx.respond("This is the last song in the queue!")
         return
     
-    skipped_title = current_song["title"]
+    skipped_title = session.current_song["title"]
     ctx.voice_client.stop()  # Will trigger after_playing which plays next
     await ctx.respond(f"⏭️ Skipped: **{skipped_title}**")
     
 @bot.slash_command(name="previous", description="Play the previous song")
 async def previous(ctx):
-    global queue_position  # Move this to the TOP of the function
+    session = sessions.get(ctx.guild.id)
     
     if ctx.voice_client is None:
         await ctx.respond("I'm not in a voice channel!")
         return
     
-    if queue_position <= 0:
+    if session.queue.position <= 0:
         await ctx.respond("This is the first song in the queue!")
         return
     
     # Calculate the target position
-    target_position = queue_position - 1
-    prev_song_title = song_queue[target_position]['title']
+    target_position = session.queue.position - 1
+    prev_song_title = session.queue[target_position].title
     
     # Set position so play_next("forward") lands on target
-    queue_position = target_position - 1
+    session.queue.position = target_position - 1
     
     if ctx.voice_client.is_playing():
         ctx.voice_client.stop()
@@ -685,21 +964,26 @@ async def previous(ctx):
     
 @bot.slash_command(name="clearqueue", description="Clear all songs from the queue")
 async def clearqueue(ctx):
-    if len(song_queue) == 0:
+    session = sessions.get(ctx.guild.id)
+    
+    if len(session.queue) == 0:
         await ctx.respond("Queue is already empty!")
         return
     
-    cleared_count = len(song_queue)
-    song_queue.clear()
+    cleared_count = len(session.queue)
+    session.queue.clear()
+    session.prefetcher.cancel()
     await ctx.respond(f"🗑️ Cleared {cleared_count} song(s) from the queue")
             
 @bot.slash_command(name="stop", description="Stop playback and clear the queue")
 async def stop(ctx):
+    session = sessions.get(ctx.guild.id)
+    
     if ctx.voice_client is None:
         await ctx.respond("I'm not in a voice channel!")
         return
     
-    if not ctx.voice_client.is_playing() and len(song_queue) == 0:
+    if not ctx.voice_client.is_playing() and len(session.queue) == 0:
         await ctx.respond("Nothing is playing and queue is empty!")
         return
     
@@ -708,50 +992,58 @@ async def stop(ctx):
         ctx.voice_client.stop()
     
     # Clear everything
-    cleared_count = len(song_queue)
-    song_queue.clear()
-    current_song["title"] = None
-    current_song["url"] = None
-    current_song["url_stream"] = None
-    current_song["start_time"] = None
+    cleared_count = len(session.queue)
+    session.queue.clear()
+    session.prefetcher.cancel()
+    session.clear_current_song()
     
     await ctx.respond(f"⏹️ Stopped playback and cleared {cleared_count} song(s) from queue")
 
 @bot.slash_command(name="nowplaying", description="Show what's currently playing")
 async def nowplaying(ctx):
+    session = sessions.get(ctx.guild.id)
 
     if ctx.voice_client is None:
         await ctx.respond("I'm not in a voice channel!")
         return
     
-    if ctx.voice_client.is_playing() and current_song["title"]:
+    if ctx.voice_client.is_playing() and session.current_song["title"]:
         import time
-        elapsed = int(time.time() - current_song["start_time"])
+        elapsed = int(time.time() - session.current_song["start_time"])
         minutes = elapsed // 60
         seconds = elapsed % 60
         
+        gap_info = ""
+        if session.track_gaps.last() is not None:
+            gap_info = (f"\n⏭️ Last track transition: {session.track_gaps.last() * 1000:.0f}ms "
+                        f"(avg {session.track_gaps.average() * 1000:.0f}ms)")
+        
         await ctx.respond(
             f"🎵 **Now Playing:**\n"
-            f"**{current_song['title']}**\n"
+            f"**{session.current_song['title']}**\n"
             f"⏱️ Playing for: {minutes}:{seconds:02d}"
+            f"{gap_info}"
         )
     else:
         await ctx.respond("Nothing is currently playing!")
         
 @bot.slash_command(name="startrecording", description="Start recording the voice channel")
-async def startrecording(ctx):
-    global is_recording, recording_sink, recording_start_time
+async def startrecording(ctx, live: bool = False):
+    session = sessions.get(ctx.guild.id)
     
     if ctx.voice_client is None:
         await ctx.respond("I need to be in a voice channel to record! Use `/join` first.")
         return
     
-    if is_recording:
+    if session.is_recording:
         await ctx.respond("Already recording!")
         return
     
-    # Try MP3Sink instead of WaveSink
-    recording_sink = discord.sinks.MP3Sink()
+    # Audio is spilled to per-speaker segment files on disk as it arrives
+    # Live mode also transcribes rolling windows while the session is going
+    session.recording_sink = SpillingSink(ctx.guild.id, channel_id=ctx.channel.id,
+                                          campaign=session.active_character_map,
+                                          model_size=model_size_for(ctx.guild.id), live=live)
     
     # Async callback for when recording stops
     async def finished_callback(sink, *args):
@@ -759,22 +1051,28 @@ async def startrecording(ctx):
     
     # Start recording
     ctx.voice_client.start_recording(
-        recording_sink,
+        session.recording_sink,
         finished_callback,
         ctx
     )
     
-    is_recording = True
-    recording_start_time = datetime.now()
+    session.is_recording = True
+    session.recording_start_time = datetime.now()
     
-    await ctx.respond("🔴 **Recording started!** Use `/stoprecording` when done.")
-    print(f"Recording started at {recording_start_time}")
+    if live:
+        session.live_transcriber = LiveTranscriber(session.recording_sink, model_size_for(ctx.guild.id))
+        session.live_transcriber.start()
+        await ctx.respond("🔴 **Recording started (live transcription)!** Use `/stoprecording` when done.")
+    else:
+        session.live_transcriber = None
+        await ctx.respond("🔴 **Recording started!** Use `/stoprecording` when done.")
+    print(f"Recording started at {session.recording_start_time}")
     
 @bot.slash_command(name="stoprecording", description="Stop recording and process the audio")
 async def stoprecording(ctx):
-    global is_recording, recording_sink, recording_start_time
+    session = sessions.get(ctx.guild.id)
     
-    if not is_recording:
+    if not session.is_recording:
         await ctx.respond("Not currently recording!")
         return
     
@@ -782,19 +1080,111 @@ async def stoprecording(ctx):
     
     # Stop recording
     ctx.voice_client.stop_recording()
-    is_recording = False
+    session.is_recording = False
+    
+    # Close the segment files; the sink itself isn't needed any more
+    sink = session.recording_sink
+    session.recording_sink = None
+    speakers = sink.speakers()
+    
+    if not speakers:
+        if session.live_transcriber is not None:
+            await session.live_transcriber.finish()
+            session.live_transcriber = None
+        discard_recording(sink.directory)
+        await ctx.respond("❌ No audio was recorded!")
+        return
     
-    # Get the recorded audio files
-    audio_data = recording_sink.audio_data
+    # Queue the recording for processing; the audio is already safe on disk
+    if session.live_transcriber is not None:
+        live_transcribers[sink.directory] = session.live_transcriber
+        session.live_transcriber = None
+    job_id = await jobs.submit(ctx.guild.id, ctx.channel.id, sink.directory,
+                               session.recording_start_time.isoformat(),
+                               session.active_character_map, model_size_for(ctx.guild.id))
+    
+    position = jobs.position(job_id)
+    if position and position > 1:
+        await ctx.respond(f"📝 Queued audio from {len(speakers)} speaker(s) as job #{job_id} "
+                          f"(position {position}). Use `/jobs` to check on it.")
+    else:
+        await ctx.respond(f"📝 Processing audio from {len(speakers)} speaker(s) as job #{job_id}... "
+                          f"This may take a few minutes.")
+
+@bot.slash_command(name="searchsessions", description="Search past session transcripts in the active campaign")
+async def searchsessions(ctx, query: str):
+    """Find moments in earlier sessions by what was said"""
+    session = sessions.get(ctx.guild.id)
+    campaign = session.active_character_map
+    
+    results = transcript_store.search(campaign_key(ctx.guild.id, campaign), query)
+    if not results:
+        await ctx.respond(f"No matches for '{query}' in campaign '{campaign}'.")
+        return
     
-    if not audio_data:
-        await ctx.respond("❌ No audio was recorded!")
+    lines = []
+    for result in results:
+        date = datetime.fromisoformat(result['started_at']).strftime("%b %d, %Y")
+        lines.append(f"**{date}** `[{format_timestamp(result['start'])}]` {result['speaker']}: {result['snippet']}")
+    
+    output = f"**Results for '{query}' in {campaign}:**\n" + "\n".join(lines)
+    await ctx.respond(output[:2000])
+
+@bot.slash_command(name="recap", description="Show the story so far for the active campaign")
+async def show_recap(ctx):
+    """Rolling campaign recap, extended after every summarized session"""
+    session = sessions.get(ctx.guild.id)
+    campaign = session.active_character_map
+    
+    existing = summary_store.recap(campaign_key(ctx.guild.id, campaign))
+    if existing is None:
+        await ctx.respond(f"No sessions have been summarized in campaign '{campaign}' yet.")
+        return
+    
+    output = f"# Story So Far: {campaign}\n*After {existing['sessions']} session(s)*\n\n{existing['recap']}"
+    await ctx.respond(output[:2000])
+
+@bot.slash_command(name="jobs", description="Show recording processing jobs for this server")
+async def jobs_status(ctx):
+    """Queue position and progress of this guild's recent recordings"""
+    recent = jobs.for_guild(ctx.guild.id)
+    if not recent:
+        await ctx.respond("No recordings have been processed yet.")
+        return
+    
+    lines = []
+    for job in recent:
+        started = datetime.fromisoformat(job['started_at']).strftime("%b %d %I:%M %p")
+        if job['status'] == 'queued':
+            status = f"⏳ queued, position {jobs.position(job['id'])} (last checkpoint: {STAGE_LABELS[job['stage']]})"
+        elif job['status'] == 'running':
+            status = f"⚙️ running (last checkpoint: {STAGE_LABELS[job['stage']]})"
+        elif job['status'] == 'failed':
+            status = f"❌ failed at '{job['stage']}': {job['error']} (`/retryjob {job['id']}` to try again)"
+        else:
+            status = "✅ done"
+        lines.append(f"**#{job['id']}** {started} ({job['campaign']}) — {status}")
+    
+    await ctx.respond("**Recording jobs:**\n" + "\n".join(lines))
+
+@bot.slash_command(name="retryjob", description="Retry a failed recording job from its last checkpoint")
+async def retryjob(ctx, job_id: int):
+    """Requeue a failed job; finished stages (e.g. the transcript) aren't redone"""
+    job = jobs.get(job_id)
+    if job is None or job['guild_id'] != ctx.guild.id:
+        await ctx.respond(f"❌ No job #{job_id} in this server.")
         return
     
-    await ctx.respond(f"📝 Processing audio from {len(audio_data)} speaker(s)... This may take a few minutes.")
+    if not await jobs.retry(job_id):
+        await ctx.respond(f"Job #{job_id} hasn't failed, nothing to retry.")
+        return
     
-    # Process the recording in a separate thread to avoid blocking
-    asyncio.create_task(process_recording(ctx, audio_data, recording_start_time))
+    await ctx.respond(f"🔁 Job #{job_id} queued again (resuming after: {STAGE_LABELS[job['stage']]}, "
+                      f"position {jobs.position(job_id)}).")
 
-# Run the bot
-bot.run(TOKEN)
\ No newline at end of file
+# Run the bot (guarded so worker processes can import this module safely)
+if __name__ == "__main__":
+    bot.run(TOKEN)
+    # Write any campaign edits and cache play times still waiting on their save delay
+    campaigns.flush()
+    audio_cache.flush()
\ No newline at end of file
@@ -0,0 +1,181 @@
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager
+
+# Directory holding campaign_<guild id>_<name>.json files
+CAMPAIGN_DIR = os.getenv('CAMPAIGN_DIR', '.')
+# Changes are written this many seconds after the last edit to a campaign
+CAMPAIGN_SAVE_DELAY = 2.0
+# Guild that campaign_<name>.json files from before campaigns were per guild are moved to
+LEGACY_CAMPAIGN_GUILD = int(os.getenv('LEGACY_CAMPAIGN_GUILD', '1236353663283495024'))
+
+
+def campaign_key(guild_id, name):
+    """Key for a guild's campaign in the transcript and summary stores"""
+    return f"{guild_id}:{name}"
+
+
+def write_atomic(path, data):
+    """Write data to a temp file and rename it over path, so a crash never leaves a half-written file"""
+    temp_path = path + '.tmp'
+    with open(temp_path, "w") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def _is_guild_id(text):
+    # Discord ids are at least 17 digits, so campaign_2024_spring.json is an old-style name
+    return text.isdigit() and len(text) >= 17
+
+
+class CampaignRepository:
+    """Campaign character mappings kept in memory with write-behind persistence
+
+    Every campaign belongs to one guild, so two servers can use the same name
+    without sharing characters. Campaign names are indexed once at startup.
+    Each campaign file is read the first time it's needed. Edits to one
+    campaign are serialized by a lock and saved shortly after the last change,
+    by writing a temp file and renaming it over the original so a crash never
+    leaves a half-written file. A second lock per campaign is held from the
+    snapshot until the rename, so saves land in order and never share the
+    temp file. Unknown campaigns raise FileNotFoundError, like
+    opening the file would.
+    """
+
+    def __init__(self, directory=CAMPAIGN_DIR, save_delay=CAMPAIGN_SAVE_DELAY):
+        self.directory = directory
+        self.save_delay = save_delay
+        self._campaigns = {}
+        self._locks = {}
+        self._write_locks = {}
+        self._dirty = set()
+        self._save_handles = {}
+        # (guild id, name) of every campaign on disk
+        self._names = set()
+        for f in sorted(os.listdir(directory)):
+            if not (f.startswith('campaign_') and f.endswith('.json')):
+                continue
+            stem = f[len('campaign_'):-len('.json')]
+            guild_id, _, name = stem.partition('_')
+            if _is_guild_id(guild_id) and name:
+                self._names.add((int(guild_id), name))
+            else:
+                key = self._migrate(stem)
+                if key is not None:
+                    self._names.add(key)
+
+    def _migrate(self, name):
+        """Move a campaign file from before campaigns were per guild to LEGACY_CAMPAIGN_GUILD"""
+        old_path = os.path.join(self.directory, f"campaign_{name}.json")
+        key = (LEGACY_CAMPAIGN_GUILD, name)
+        if os.path.exists(self._path(key)):
+            print(f"Skipping old campaign file {old_path}: {self._path(key)} already exists")
+            return None
+        os.replace(old_path, self._path(key))
+        print(f"Moved old campaign '{name}' to guild {LEGACY_CAMPAIGN_GUILD}")
+        return key
+
+    def _path(self, key):
+        guild_id, name = key
+        return os.path.join(self.directory, f"campaign_{guild_id}_{name}.json")
+
+    def names(self, guild_id):
+        return sorted(name for owner, name in self._names if owner == guild_id)
+
+    def exists(self, guild_id, name):
+        return (guild_id, name) in self._names
+
+    def get(self, guild_id, name):
+        """The in-memory character map for a campaign (treat it as read-only)"""
+        key = (guild_id, name)
+        if key not in self._names:
+            raise FileNotFoundError(self._path(key))
+        char_map = self._campaigns.get(key)
+        if char_map is None:
+            with open(self._path(key), "r") as f:
+                char_map = json.load(f)
+            self._campaigns[key] = char_map
+        return char_map
+
+    def _lock(self, key):
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
+
+    def _write_lock(self, key):
+        lock = self._write_locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._write_locks[key] = lock
+        return lock
+
+    async def create(self, guild_id, name):
+        """Create an empty campaign; returns False if it already exists"""
+        key = (guild_id, name)
+        async with self._lock(key):
+            if key in self._names:
+                return False
+            self._names.add(key)
+            self._campaigns[key] = {}
+            # Write new campaigns straight away so they show up on disk
+            await asyncio.to_thread(self._write, key, json.dumps({}, indent=2))
+            return True
+
+    @asynccontextmanager
+    async def edit(self, guild_id, name):
+        """Lock a campaign and yield its character map for changes"""
+        key = (guild_id, name)
+        async with self._lock(key):
+            char_map = self.get(guild_id, name)
+            yield char_map
+            self._dirty.add(key)
+            self._schedule_save(key)
+
+    def _schedule_save(self, key):
+        handle = self._save_handles.pop(key, None)
+        if handle is not None:
+            handle.cancel()
+        loop = asyncio.get_running_loop()
+        self._save_handles[key] = loop.call_later(
+            self.save_delay, lambda: asyncio.create_task(self._save(key))
+        )
+
+    async def _save(self, key):
+        self._save_handles.pop(key, None)
+        async with self._lock(key):
+            if key not in self._dirty:
+                return
+            self._dirty.discard(key)
+            # Snapshot under the lock; the file write itself happens off the loop.
+            # Taking the write lock before letting edits go keeps saves in snapshot order
+            data = json.dumps(self._campaigns[key], indent=2)
+            write_lock = self._write_lock(key)
+            await write_lock.acquire()
+        try:
+            await asyncio.to_thread(self._write, key, data)
+        except OSError as e:
+            self._dirty.add(key)
+            print(f"Could not save campaign '{key[1]}': {e}")
+        finally:
+            write_lock.release()
+
+    def _write(self, key, data):
+        write_atomic(self._path(key), data)
+
+    def flush(self):
+        """Write every campaign with unsaved changes right now (e.g. on shutdown)"""
+        for handle in self._save_handles.values():
+            handle.cancel()
+        self._save_handles.clear()
+        for key in list(self._dirty):
+            self._write(key, json.dumps(self._campaigns[key], indent=2))
+            self._dirty.discard(key)
+
+
+# Shared repository for all guilds
+campaigns = CampaignRepository()
@@ -0,0 +1,31 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class Database:
+    """One SQLite connection shared by the event loop and worker threads
+
+    WAL mode lets readers carry on while a write commits. The connection isn't
+    safe to use from two threads at once, so every use holds the lock.
+    """
+
+    def __init__(self, path, schema):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(schema)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def transaction(self):
+        """Yield the connection; everything done with it is committed together (or rolled back)"""
+        with self._lock, self._conn:
+            yield self._conn
+
+    def query(self, sql, params=()):
+        """Rows as dicts"""
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params).fetchall()]
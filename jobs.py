@@ -0,0 +1,160 @@
+import asyncio
+import os
+import time
+
+from database import Database
+
+# SQLite file holding recording jobs and their checkpoints
+JOBS_DB = os.getenv('JOBS_DB', 'jobs.sqlite3')
+# How many recordings are processed at the same time
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '1'))
+
+# Checkpoints in order; a job resumes from the last one it reached
+STAGE_LABELS = {
+    'audio_saved': "audio saved",
+    'transcribed': "transcript done",
+    'summarized': "summary done",
+    'done': "posted",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    recording_dir TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    campaign TEXT NOT NULL,
+    model_size TEXT NOT NULL,
+    stage TEXT NOT NULL DEFAULT 'audio_saved',
+    status TEXT NOT NULL DEFAULT 'queued',
+    transcript TEXT,
+    summary TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_by_guild ON jobs (guild_id, id);
+"""
+
+
+class JobQueue:
+    """Durable queue of recording jobs, processed by a fixed number of workers
+
+    Jobs and their checkpoints live in SQLite, so a restart picks up every job
+    that was queued or running from the last checkpoint it reached. Failed jobs
+    are kept (with their audio) but not retried automatically; retry() queues
+    one again from its last checkpoint.
+    """
+
+    def __init__(self, path=JOBS_DB, workers=JOB_WORKERS):
+        self.workers = workers
+        self._db = Database(path, SCHEMA)
+        self._queue = None
+        self._tasks = []
+
+    def _execute(self, sql, params=()):
+        with self._db.transaction() as db:
+            cursor = db.execute(sql, params)
+            return cursor.lastrowid, [dict(row) for row in cursor.fetchall()]
+
+    async def _run(self, sql, params=()):
+        # Commits fsync, so keep them off the event loop
+        return await asyncio.to_thread(self._execute, sql, params)
+
+    async def submit(self, guild_id, channel_id, recording_dir, started_at, campaign, model_size):
+        """Queue a recording whose audio is already on disk; returns the job id"""
+        now = time.time()
+        job_id, _ = await self._run(
+            "INSERT INTO jobs (guild_id, channel_id, recording_dir, started_at, campaign, model_size,"
+            " created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (guild_id, channel_id, recording_dir, started_at, campaign, model_size, now, now)
+        )
+        if self._queue is not None:
+            self._queue.put_nowait(job_id)
+        return job_id
+
+    async def checkpoint(self, job_id, stage, **fields):
+        """Record that a job reached a stage, saving any results that go with it"""
+        fields['stage'] = stage
+        if stage == 'done':
+            fields['status'] = 'done'
+        fields['updated_at'] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        await self._run(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    async def retry(self, job_id):
+        """Queue a failed job again; returns False if it isn't a failed job"""
+        job = self.get(job_id)
+        if job is None or job['status'] != 'failed':
+            return False
+        await self._set_status(job_id, 'queued')
+        if self._queue is not None:
+            self._queue.put_nowait(job_id)
+        return True
+
+    async def _set_status(self, job_id, status, error=None):
+        await self._run("UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                        (status, error, time.time(), job_id))
+
+    def get(self, job_id):
+        _, rows = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        return rows[0] if rows else None
+
+    def for_guild(self, guild_id, limit=10):
+        """A guild's most recent jobs, newest first"""
+        _, rows = self._execute("SELECT * FROM jobs WHERE guild_id = ? ORDER BY id DESC LIMIT ?",
+                                (guild_id, limit))
+        return rows
+
+    def recording_dirs(self):
+        """Every recording directory some job refers to"""
+        _, rows = self._execute("SELECT DISTINCT recording_dir FROM jobs")
+        return {row['recording_dir'] for row in rows}
+
+    def position(self, job_id):
+        """1-based place in line among queued jobs (None once it has started)"""
+        job = self.get(job_id)
+        if job is None or job['status'] != 'queued':
+            return None
+        _, rows = self._execute("SELECT COUNT(*) AS ahead FROM jobs WHERE status = 'queued' AND id < ?",
+                                (job_id,))
+        return rows[0]['ahead'] + 1
+
+    async def start(self, handler):
+        """Start the workers and requeue whatever was unfinished at the last shutdown
+
+        handler(job) is awaited for each job and is expected to checkpoint its
+        way to 'done'; an exception marks the job failed.
+        """
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue()
+
+        _, unfinished = await self._run(
+            "SELECT id, stage FROM jobs WHERE status IN ('queued', 'running') ORDER BY id")
+        for job in unfinished:
+            await self._set_status(job['id'], 'queued')
+            self._queue.put_nowait(job['id'])
+        if unfinished:
+            print(f"Resuming {len(unfinished)} recording job(s)")
+
+        self._tasks = [asyncio.create_task(self._worker(handler)) for _ in range(self.workers)]
+
+    async def _worker(self, handler):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._set_status(job_id, 'running')
+                job = self.get(job_id)
+                print(f"Job {job_id}: starting from '{job['stage']}'")
+                await handler(job)
+            except Exception as e:
+                print(f"Job {job_id} failed: {e}")
+                await self._set_status(job_id, 'failed', str(e))
+            finally:
+                self._queue.task_done()
+
+
+# Shared queue for all guilds
+jobs = JobQueue()
@@ -0,0 +1,102 @@
+import asyncio
+import os
+import time
+
+import metrics
+from audio import PCM_BYTES_PER_SECOND
+from transcription import transcribe_pcm, transcribe_spans, shift_segments, WHISPER_MODEL
+from workers import transcription_pool
+
+# Length of each rolling window transcribed during a live recording (seconds)
+LIVE_WINDOW_SECONDS = int(os.getenv('LIVE_WINDOW_SECONDS', '45'))
+
+
+class LiveTranscriber:
+    """Transcribes a SpillingSink(live=True) in rolling windows while the session is recorded
+
+    A window that fails is remembered as a byte range of each speaker's stream
+    and later windows carry on as normal. finish() transcribes just those
+    ranges again from the segment files, which hold the same audio.
+    """
+
+    def __init__(self, sink, model_size=WHISPER_MODEL, window=LIVE_WINDOW_SECONDS):
+        self.sink = sink
+        self.model_size = model_size
+        self.window = window
+        self.segments = {}
+        self.windows_done = 0
+        self.windows_failed = 0
+        # Bytes of each user's stream already drained
+        self._positions = {}
+        # One {user id: (start, end) bytes of their stream} per failed window
+        self._failed_spans = []
+        self._stopping = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.window)
+            except asyncio.TimeoutError:
+                pass
+            
+            await self._transcribe_window()
+            
+            if self._stopping.is_set():
+                return
+
+    async def _transcribe_window(self):
+        streams = self.sink.drain()
+        if not streams:
+            return
+        
+        # Each user's PCM carries on from where their last drain ended, and
+        # their stream starts at their first packet
+        stream_starts = self.sink.offsets()
+        offsets = {}
+        spans = {}
+        for user_id, pcm in streams.items():
+            position = self._positions.get(user_id, 0)
+            offsets[user_id] = (stream_starts.get(user_id) or 0.0) + position / PCM_BYTES_PER_SECOND
+            spans[user_id] = (position, position + len(pcm))
+            self._positions[user_id] = position + len(pcm)
+        
+        started = time.perf_counter()
+        try:
+            results = await transcription_pool.run(transcribe_pcm, streams, self.model_size)
+        except Exception as e:
+            self.windows_failed += 1
+            self._failed_spans.append(spans)
+            print(f"Live transcription error: {e}")
+            return
+        audio_seconds = max(len(pcm) for pcm in streams.values()) / PCM_BYTES_PER_SECOND
+        if audio_seconds > 0:
+            metrics.transcription_rtf.observe((time.perf_counter() - started) / audio_seconds, mode='live')
+        self.windows_done += 1
+        for user_id, segments in results.items():
+            self.segments.setdefault(user_id, []).extend(shift_segments(segments, offsets[user_id]))
+        print(f"Live window {self.windows_done} transcribed ({len(results)} speaker(s))")
+
+    async def finish(self):
+        """Transcribe the last partial window and any failed ones, and return {user id: segments}"""
+        self._stopping.set()
+        if self._task is not None:
+            await self._task
+        if self._failed_spans:
+            await self._retry_failed()
+        return self.segments
+
+    async def _retry_failed(self):
+        # The sink is closed by now, so the segment files hold every drained byte
+        streams = self.sink.speakers()
+        stream_starts = self.sink.offsets()
+        for spans in self._failed_spans:
+            results = await transcription_pool.run(transcribe_spans, streams, spans, self.model_size)
+            for user_id, segments in results.items():
+                offset = (stream_starts.get(user_id) or 0.0) + spans[user_id][0] / PCM_BYTES_PER_SECOND
+                self.segments.setdefault(user_id, []).extend(shift_segments(segments, offset))
+        print(f"Re-transcribed {len(self._failed_spans)} failed live window(s) from the segment files")
+        self._failed_spans = []
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import os
+
+import aiohttp
+
+import metrics
+
+# Ollama endpoint and model used for session summaries
+OLLAMA_URL = os.getenv('OLLAMA_URL', 'http://localhost:11434/api/generate')
+OLLAMA_MODEL = os.getenv('OLLAMA_MODEL', 'llama3.2')
+
+# Seconds to wait for a connection / between streamed chunks
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv('OLLAMA_CONNECT_TIMEOUT', '10'))
+OLLAMA_READ_TIMEOUT = float(os.getenv('OLLAMA_READ_TIMEOUT', '300'))
+OLLAMA_RETRIES = int(os.getenv('OLLAMA_RETRIES', '3'))
+OLLAMA_MAX_CONNECTIONS = int(os.getenv('OLLAMA_MAX_CONNECTIONS', '4'))
+
+
+class LLMError(Exception):
+    pass
+
+
+class _ServerError(LLMError):
+    """Ollama answered with a 5xx, which is worth retrying"""
+
+
+# Failures that may go away on their own; anything else fails straight away
+RETRYABLE_ERRORS = (_ServerError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError,
+                    asyncio.TimeoutError)
+
+
+async def check_status(response):
+    """Raise for an error status; only a 5xx is retried"""
+    if response.status >= 500:
+        raise _ServerError(f"Ollama returned HTTP {response.status}")
+    if response.status >= 400:
+        raise LLMError(f"Ollama returned HTTP {response.status}: {(await response.text())[:200]}")
+
+
+def record_speed(data):
+    """Generation speed from the eval stats Ollama sends with its final response"""
+    tokens = data.get('eval_count')
+    duration = data.get('eval_duration')
+    if tokens and duration:
+        metrics.llm_tokens.inc(tokens)
+        metrics.llm_tokens_per_second.observe(tokens / (duration / 1e9))
+
+
+class OllamaClient:
+    """Async Ollama client with a persistent connection pool, timeouts and retries"""
+
+    def __init__(self, url=OLLAMA_URL, model=OLLAMA_MODEL, retries=OLLAMA_RETRIES,
+                 backoff=1.0, max_connections=OLLAMA_MAX_CONNECTIONS,
+                 connect_timeout=OLLAMA_CONNECT_TIMEOUT, read_timeout=OLLAMA_READ_TIMEOUT):
+        self.url = url
+        self.model = model
+        self.retries = retries
+        self.backoff = backoff
+        self.max_connections = max_connections
+        self.timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout,
+                                             sock_read=read_timeout)
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                timeout=self.timeout
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _retry_delay(self, attempt, error):
+        delay = self.backoff * (2 ** attempt)
+        print(f"Ollama request failed ({error}), retrying in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+    async def generate(self, prompt):
+        """Generate a full response in one request"""
+        payload = {'model': self.model, 'prompt': prompt, 'stream': False}
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._get_session().post(self.url, json=payload) as response:
+                    await check_status(response)
+                    data = await response.json(content_type=None)
+                    record_speed(data)
+                    return data['response']
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.retries:
+                    raise LLMError(f"Ollama request failed: {e}") from e
+                await self._retry_delay(attempt, e)
+            except (aiohttp.ClientError, ValueError, KeyError) as e:
+                # Includes a body that isn't JSON; asking again won't fix it
+                raise LLMError(f"Ollama request failed: {e!r}") from e
+
+    async def stream(self, prompt):
+        """Yield response tokens as Ollama produces them
+
+        Retries only happen before the first token arrives, so the caller never
+        sees the same text twice.
+        """
+        payload = {'model': self.model, 'prompt': prompt, 'stream': True}
+        for attempt in range(self.retries + 1):
+            started = False
+            try:
+                async with self._get_session().post(self.url, json=payload) as response:
+                    await check_status(response)
+                    # One JSON object per line
+                    async for line in response.content:
+                        if not line.strip():
+                            continue
+                        chunk = json.loads(line)
+                        if 'error' in chunk:
+                            raise LLMError(chunk['error'])
+                        if chunk.get('response'):
+                            started = True
+                            yield chunk['response']
+                        if chunk.get('done'):
+                            record_speed(chunk)
+                            return
+                    return
+            except RETRYABLE_ERRORS as e:
+                if started or attempt == self.retries:
+                    raise LLMError(f"Ollama stream failed: {e}") from e
+                await self._retry_delay(attempt, e)
+            except (aiohttp.ClientError, ValueError) as e:
+                # Includes a line that isn't JSON
+                raise LLMError(f"Ollama stream failed: {e!r}") from e
+
+
+# Shared client so connections are reused across summaries
+ollama = OllamaClient()
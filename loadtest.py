@@ -0,0 +1,195 @@
+"""Multi-guild load test that drives the bot's real command handlers
+
+Runs many fake guilds queueing, skipping, paging and clearing at once on one
+event loop, through the actual slash command callbacks, play_next and the
+idle-session sweep. Only the edges are faked: Discord contexts and voice
+clients, yt-dlp lookups and FFmpeg sources. Reports how late a 10 ms
+heartbeat timer fires and how long each command took. Usage:
+
+    python loadtest.py --guilds 200 --seconds 30
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import statistics
+import tempfile
+import time
+from types import SimpleNamespace
+
+# Keep the bot's databases, campaigns and audio cache away from the real ones
+_scratch = tempfile.mkdtemp(prefix='dnd_loadtest_')
+for _name, _value in [('JOBS_DB', 'jobs.sqlite3'), ('TRANSCRIPTS_DB', 'transcripts.sqlite3'),
+                      ('SUMMARIES_DB', 'summaries.sqlite3'), ('AUDIO_CACHE_DIR', 'audio_cache'),
+                      ('CAMPAIGN_DIR', '.')]:
+    os.environ[_name] = os.path.join(_scratch, _value)
+
+import bot as dnd_bot
+import player
+
+# How long a fake track "plays" before the voice client calls after() (seconds)
+TRACK_SECONDS = (2.0, 8.0)
+# Share of lookups that fail like an unavailable video
+RESOLVE_FAILURE_RATE = 0.05
+
+
+class FakeResolver:
+    """Stands in for yt-dlp: a short wait, then made-up stream info"""
+
+    def __init__(self):
+        self._metadata = {}
+
+    async def resolve(self, url):
+        await asyncio.sleep(random.uniform(0.01, 0.2))
+        if random.random() < RESOLVE_FAILURE_RATE:
+            raise RuntimeError("Video unavailable")
+        metadata = {'title': f"Track {url.rsplit('/', 1)[-1]}", 'webpage_url': url,
+                    # Short enough that the next track is prefetched while this one plays
+                    'duration': int(player.PREFETCH_LEAD_SECONDS + random.uniform(*TRACK_SECONDS))}
+        self._metadata[url] = metadata
+        return {**metadata, 'url': url + '/stream', 'codec': 'opus'}
+
+    def metadata(self, url):
+        return self._metadata.get(url)
+
+
+class FakeSource:
+    def cleanup(self):
+        pass
+
+
+async def fake_create_source(stream_url, codec=None):
+    return FakeSource()
+
+
+class FakeVoiceClient:
+    """Plays a source for a few seconds, then calls after() like discord's player thread"""
+
+    def __init__(self):
+        self._timer = None
+        self._after = None
+
+    def is_playing(self):
+        return self._timer is not None
+
+    def play(self, source, after=None):
+        self._after = after
+        self._timer = asyncio.get_running_loop().call_later(random.uniform(*TRACK_SECONDS), self._finish)
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._finish()
+
+    def _finish(self):
+        self._timer = None
+        after, self._after = self._after, None
+        if after is not None:
+            after(None)
+
+
+class FakeContext:
+    """The parts of ApplicationContext the music commands use"""
+
+    def __init__(self, guild_id, voice_client):
+        self.guild = SimpleNamespace(id=guild_id)
+        self.voice_client = voice_client
+        self.author = SimpleNamespace(voice=None)
+
+    async def respond(self, content=None, **kwargs):
+        pass
+
+    async def edit(self, content=None, **kwargs):
+        pass
+
+
+async def run_command(timings, name, command, ctx, *args):
+    started = time.perf_counter()
+    await command.callback(ctx, *args)
+    timings.setdefault(name, []).append(time.perf_counter() - started)
+
+
+async def simulate_guild(guild_id, voice_client, stop_at, quiet_at, timings):
+    """One table's worth of music commands; goes quiet at quiet_at so its state can be evicted"""
+    added = 0
+    while time.monotonic() < min(stop_at, quiet_at):
+        ctx = FakeContext(guild_id, voice_client)
+        action = random.random()
+        if action < 0.4:
+            # Some requests repeat an earlier song, which is queued from cached metadata
+            if added and random.random() < 0.3:
+                number = random.randint(1, added)
+            else:
+                added += 1
+                number = added
+            await run_command(timings, 'queue', dnd_bot.queue_song, ctx, f"https://example.com/{guild_id}/{number}")
+        elif action < 0.6:
+            await run_command(timings, 'skip', dnd_bot.skip, ctx)
+        elif action < 0.9:
+            await run_command(timings, 'showqueue', dnd_bot.showqueue, ctx)
+        else:
+            await run_command(timings, 'clearqueue', dnd_bot.clearqueue, ctx)
+        await asyncio.sleep(random.uniform(0.05, 0.5))
+
+
+async def measure_lag(stop_at, interval=0.01):
+    """How late each interval-second sleep wakes up"""
+    lags = []
+    while time.monotonic() < stop_at:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+    return lags
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+async def main(guilds, seconds):
+    resolver = FakeResolver()
+    dnd_bot.resolver = player.resolver = resolver
+    dnd_bot.create_source = player.create_source = fake_create_source
+    dnd_bot.audio_cache.schedule_fill = lambda track: None
+    # after() hands play_next back to the bot's loop
+    dnd_bot.bot.loop = asyncio.get_running_loop()
+
+    sessions = dnd_bot.sessions
+    sessions.idle_timeout = seconds / 4
+    # Two in three guilds sit in voice; a guild that's still playing is never evicted
+    voice_clients = {guild_id: FakeVoiceClient() if guild_id % 3 else None for guild_id in range(guilds)}
+    sweeper = asyncio.create_task(sessions.run_evictions(
+        lambda guild_id: voice_clients[guild_id] is not None and voice_clients[guild_id].is_playing(),
+        interval=1.0))
+
+    now = time.monotonic()
+    stop_at = now + seconds
+    timings = {}
+    lag_task = asyncio.create_task(measure_lag(stop_at))
+    # The handlers print as they go; keep the report readable
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        await asyncio.gather(*[
+            simulate_guild(guild_id, voice_clients[guild_id], stop_at,
+                           now + random.uniform(seconds / 4, seconds), timings)
+            for guild_id in range(guilds)
+        ])
+        lags = await lag_task
+    sweeper.cancel()
+
+    lags.sort()
+    print(f"Guilds: {guilds}, sessions alive after the idle sweep: {len(sessions)}")
+    print(f"Event loop lag: p50 {statistics.median(lags) * 1000:.2f}ms, "
+          f"p99 {percentile(lags, 0.99) * 1000:.2f}ms, max {lags[-1] * 1000:.2f}ms")
+    for name, values in sorted(timings.items()):
+        values.sort()
+        print(f"/{name}: n={len(values)} p50 {statistics.median(values) * 1000:.1f}ms "
+              f"p99 {percentile(values, 0.99) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--guilds', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=30)
+    args = parser.parse_args()
+    asyncio.run(main(args.guilds, args.seconds))
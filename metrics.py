@@ -0,0 +1,250 @@
+import asyncio
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+# Serve Prometheus text metrics on this local port (0 = off)
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+# How often the event loop lag probe runs (seconds)
+LOOP_LAG_INTERVAL = 1.0
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+RATIO_BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 4)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 35, 50, 75, 100, 200)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._render_samples())
+        return lines
+
+
+class Counter(Metric):
+    """Monotonically increasing count, optionally split by labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        super().__init__(name, help)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def _render_samples(self):
+        return [f"{self.name}{_format_labels(key)} {value}" for key, value in self.values().items()]
+
+
+class Gauge(Metric):
+    """Value that goes up and down; with fn it's read fresh each time it's reported"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, fn=None):
+        super().__init__(name, help)
+        self.fn = fn
+        self._values = {}
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def values(self):
+        if self.fn is not None:
+            return {(): self.fn()}
+        with self._lock:
+            return dict(self._values)
+
+    def _render_samples(self):
+        return [f"{self.name}{_format_labels(key)} {value}" for key, value in self.values().items()]
+
+
+class Histogram(Metric):
+    """Bucketed distribution plus a window of recent values for percentiles"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, recent=500):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+        self.recent = recent
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0,
+                          'recent': deque(maxlen=self.recent)}
+                self._series[key] = series
+            series['counts'][bisect_left(self.buckets, value)] += 1
+            series['sum'] += value
+            series['count'] += 1
+            series['recent'].append(value)
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def summary(self):
+        """{labels: (count, p50, p95, max)} over the recent window of each series"""
+        with self._lock:
+            series = {key: (s['count'], sorted(s['recent'])) for key, s in self._series.items()}
+        result = {}
+        for key, (count, recent) in series.items():
+            if not recent:
+                continue
+            result[key] = (count, recent[len(recent) // 2],
+                           recent[min(int(len(recent) * 0.95), len(recent) - 1)], recent[-1])
+        return result
+
+    def _render_samples(self):
+        with self._lock:
+            series = {key: (list(s['counts']), s['sum'], s['count']) for key, s in self._series.items()}
+        lines = []
+        for key, (counts, total, count) in series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float('inf') else repr(float(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class Registry:
+    """Holds every metric; get-or-create so modules can declare what they use"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _get(self, cls, name, *args, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = cls(name, *args, **kwargs)
+            self._metrics[name] = metric
+        return metric
+
+    def counter(self, name, help):
+        return self._get(Counter, name, help)
+
+    def gauge(self, name, help, fn=None):
+        return self._get(Gauge, name, help, fn)
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help, buckets)
+
+    def __iter__(self):
+        return iter(list(self._metrics.values()))
+
+    def render_prometheus(self):
+        lines = []
+        for metric in self:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry (only the bot process reports; workers return timings instead)
+registry = Registry()
+
+command_seconds = registry.histogram('dnd_command_seconds', 'Slash command handling time')
+command_errors = registry.counter('dnd_command_errors_total', 'Slash commands that raised')
+resolve_seconds = registry.histogram('dnd_resolve_seconds', 'yt-dlp extraction time')
+resolve_requests = registry.counter('dnd_resolve_requests_total', 'Stream lookups by cache result')
+ffmpeg_spawn_seconds = registry.histogram('dnd_ffmpeg_spawn_seconds', 'Time to probe and start an FFmpeg audio source')
+track_gap_seconds = registry.histogram('dnd_track_gap_seconds', 'Silence between one track ending and the next starting')
+transcription_rtf = registry.histogram('dnd_transcription_rtf', 'Transcription time / audio duration', RATIO_BUCKETS)
+llm_tokens_per_second = registry.histogram('dnd_llm_tokens_per_second', 'Ollama generation speed', RATE_BUCKETS)
+llm_tokens = registry.counter('dnd_llm_tokens_total', 'Tokens generated by Ollama')
+loop_lag_seconds = registry.histogram('dnd_event_loop_lag_seconds', 'How late a periodic timer fires on the event loop')
+
+
+def _format_value(name, value):
+    if name.endswith('_seconds'):
+        return f"{value * 1000:.0f}ms"
+    return f"{value:.2f}"
+
+
+def format_stats(metrics=registry):
+    """Plain-text overview of every metric for /stats"""
+    lines = []
+    for metric in metrics:
+        short = metric.name.replace('dnd_', '', 1)
+        if isinstance(metric, Histogram):
+            for key, (count, p50, p95, largest) in sorted(metric.summary().items()):
+                lines.append(f"{short}{_format_labels(key)}: n={count} p50 {_format_value(metric.name, p50)} "
+                             f"p95 {_format_value(metric.name, p95)} max {_format_value(metric.name, largest)}")
+        else:
+            for key, value in sorted(metric.values().items()):
+                lines.append(f"{short}{_format_labels(key)}: {value}")
+    return "\n".join(lines)
+
+
+async def monitor_loop_lag(interval=LOOP_LAG_INTERVAL):
+    """Record how late an interval-second sleep wakes up, forever"""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        loop_lag_seconds.observe(max(time.perf_counter() - started - interval, 0.0))
+
+
+async def start_http_server(port=METRICS_PORT, host=METRICS_HOST):
+    """Serve /metrics in Prometheus text format; returns the runner (None if disabled)"""
+    if not port:
+        return None
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=registry.render_prometheus(), content_type='text/plain')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Metrics available at http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,150 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+import discord
+
+import metrics
+from resolver import resolver
+from audio_cache import audio_cache
+
+FFMPEG_BEFORE_OPTIONS = '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
+
+FFMPEG_OPTIONS = {
+    'before_options': FFMPEG_BEFORE_OPTIONS,
+    'options': '-vn -b:a 128k'
+}
+
+# 'opus' sends Opus packets to Discord directly (copying them when the source is
+# already Opus); 'pcm' decodes to PCM and lets the voice client encode every frame
+PLAYBACK_MODE = os.getenv('PLAYBACK_MODE', 'opus')
+OPUS_BITRATE = 128
+
+# Start getting the next track ready this many seconds before the current one ends
+PREFETCH_LEAD_SECONDS = 15
+
+
+async def create_source(stream_url, codec=None):
+    """Audio source for a resolved stream URL
+
+    Opus input is passed through without transcoding. Other codecs are encoded
+    to Opus by FFmpeg itself. PCM is only used when asked for or when the codec
+    can't be determined.
+    """
+    started = time.perf_counter()
+    if PLAYBACK_MODE == 'opus':
+        if codec is None:
+            try:
+                codec, _ = await discord.FFmpegOpusAudio.probe(stream_url)
+            except Exception as e:
+                print(f"Codec probe failed, falling back to PCM: {e}")
+        
+        if codec == 'opus':
+            # py-cord maps codec='opus' to '-c:a copy'; any other value re-encodes
+            source = discord.FFmpegOpusAudio(stream_url, codec='opus',
+                                             before_options=FFMPEG_BEFORE_OPTIONS, options='-vn')
+            metrics.ffmpeg_spawn_seconds.observe(time.perf_counter() - started, path='copy')
+            return source
+        if codec is not None:
+            source = discord.FFmpegOpusAudio(stream_url, bitrate=OPUS_BITRATE,
+                                             before_options=FFMPEG_BEFORE_OPTIONS, options='-vn')
+            metrics.ffmpeg_spawn_seconds.observe(time.perf_counter() - started, path='encode')
+            return source
+    
+    source = discord.FFmpegPCMAudio(stream_url, **FFMPEG_OPTIONS)
+    metrics.ffmpeg_spawn_seconds.observe(time.perf_counter() - started, path='pcm')
+    return source
+
+
+def create_local_source(path):
+    """Audio source for a cached Opus file (copied straight through)"""
+    with metrics.ffmpeg_spawn_seconds.time(path='cache'):
+        return discord.FFmpegOpusAudio(path, codec='opus', options='-vn')
+
+
+class Prefetcher:
+    """Gets the next queue entry ready while the current one plays
+
+    Shortly before the current track ends the next entry's stream URL is
+    refreshed (if needed) and its FFmpeg process is spawned, so it is already
+    buffering when the handoff happens.
+    """
+
+    def __init__(self):
+        self._handle = None
+        self._task = None
+        self._prefetched = None
+
+    def schedule(self, song, delay):
+        """Prefetch song after delay seconds, replacing anything pending"""
+        self.cancel()
+        loop = asyncio.get_running_loop()
+        self._handle = loop.call_later(max(delay, 0), self._start, song)
+
+    def _start(self, song):
+        self._handle = None
+        self._task = asyncio.create_task(self._prefetch(song))
+
+    async def _prefetch(self, song):
+        try:
+            cached = audio_cache.lookup(song.webpage_url)
+            if cached is not None:
+                self._prefetched = (song.webpage_url, create_local_source(cached['file']))
+                return
+            
+            info = await resolver.resolve(song.webpage_url)
+            song.url = info['url']
+            song.codec = info['codec']
+            self._prefetched = (song.webpage_url, await create_source(info['url'], info['codec']))
+            print(f"Prefetched next track: {info['title']}")
+        except Exception as e:
+            print(f"Prefetch failed for {song.title}: {e}")
+
+    def ready_for(self, song):
+        return self._prefetched is not None and self._prefetched[0] == song.webpage_url
+
+    def take(self, song):
+        """Hand over the prefetched source if it is for this song"""
+        if not self.ready_for(song):
+            return None
+        source = self._prefetched[1]
+        self._prefetched = None
+        return source
+
+    def cancel(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._prefetched is not None:
+            self._prefetched[1].cleanup()
+            self._prefetched = None
+
+
+class GapTracker:
+    """Measures silence between one track ending and the next starting"""
+
+    def __init__(self, keep=100):
+        self.gaps = deque(maxlen=keep)
+        self._ended_at = None
+
+    def track_ended(self):
+        self._ended_at = time.perf_counter()
+
+    def track_started(self):
+        if self._ended_at is None:
+            return None
+        gap = time.perf_counter() - self._ended_at
+        self._ended_at = None
+        self.gaps.append(gap)
+        metrics.track_gap_seconds.observe(gap)
+        return gap
+
+    def last(self):
+        return self.gaps[-1] if self.gaps else None
+
+    def average(self):
+        return sum(self.gaps) / len(self.gaps) if self.gaps else None
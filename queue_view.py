@@ -0,0 +1,105 @@
+import time
+
+import discord
+
+# Songs shown per /showqueue page
+QUEUE_PAGE_SIZE = 15
+# Long titles are cut so a full page stays under Discord's 2000 character limit
+MAX_TITLE_LENGTH = 90
+
+
+class QueueLines:
+    """Cached '#. title' lines for a TrackQueue
+
+    The whole cache is dropped when the queue's version changes; a single
+    line is re-rendered if its title or availability was filled in later.
+    """
+
+    def __init__(self):
+        self._version = None
+        self._lines = {}
+
+    def line(self, queue, index):
+        if self._version != queue.version:
+            self._lines.clear()
+            self._version = queue.version
+        
+        track = queue[index]
+        key = (track.title, track.unavailable)
+        cached = self._lines.get(index)
+        if cached is None or cached[0] != key:
+            title = track.title if len(track.title) <= MAX_TITLE_LENGTH else track.title[:MAX_TITLE_LENGTH - 1] + "…"
+            unavailable = " *(unavailable)*" if track.unavailable else ""
+            cached = (key, f"{index + 1}. {title}{unavailable}")
+            self._lines[index] = cached
+        return cached[1]
+
+
+def page_count(session):
+    return max(1, (len(session.queue) + QUEUE_PAGE_SIZE - 1) // QUEUE_PAGE_SIZE)
+
+
+def current_page(session):
+    """Page holding the song that's playing (or the first page)"""
+    return max(session.queue.position, 0) // QUEUE_PAGE_SIZE
+
+
+def render_page(session, page):
+    """Render one page of the queue; only the visible lines are touched"""
+    queue = session.queue
+    start = page * QUEUE_PAGE_SIZE
+    end = min(start + QUEUE_PAGE_SIZE, len(queue))
+    
+    message = f"📋 **Queue ({len(queue)} song(s))** - page {page + 1}/{page_count(session)}\n\n"
+    for i in range(start, end):
+        # Highlight currently playing song
+        if i == queue.position and session.current_song["title"]:
+            elapsed = int(time.time() - session.current_song["start_time"])
+            minutes = elapsed // 60
+            seconds = elapsed % 60
+            message += f"▶️ **{session.queue_lines.line(queue, i)}** ({minutes}:{seconds:02d})\n"
+        else:
+            message += session.queue_lines.line(queue, i) + "\n"
+    return message
+
+
+class QueueView(discord.ui.View):
+    """Previous/next buttons for paging through /showqueue; disabled after 3 minutes idle"""
+
+    def __init__(self, session, page):
+        super().__init__(timeout=180)
+        self.session = session
+        self.page = page
+        self._update_buttons()
+
+    def _update_buttons(self):
+        self.previous_page.disabled = self.page <= 0
+        self.next_page.disabled = self.page >= page_count(self.session) - 1
+
+    async def on_timeout(self):
+        # Leave the last page up, but with buttons that visibly no longer work
+        self.disable_all_items()
+        # py-cord keeps the interaction that sent the view as its parent
+        message = self.message or self.parent
+        if message is None:
+            return
+        try:
+            await message.edit(view=self)
+        except discord.HTTPException as e:
+            print(f"Could not disable queue buttons: {e}")
+
+    async def _show(self, interaction):
+        # The queue may have shrunk since the last page was shown
+        self.page = min(self.page, page_count(self.session) - 1)
+        self._update_buttons()
+        await interaction.response.edit_message(content=render_page(self.session, self.page), view=self)
+
+    @discord.ui.button(label="◀ Prev", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, button, interaction):
+        self.page = max(self.page - 1, 0)
+        await self._show(interaction)
+
+    @discord.ui.button(label="Next ▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, button, interaction):
+        self.page += 1
+        await self._show(interaction)
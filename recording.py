@@ -0,0 +1,200 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import discord
+
+from audio import PCM_BYTES_PER_SECOND
+
+# Where recordings are spilled while a session is going
+RECORDINGS_DIR = os.getenv('RECORDINGS_DIR', 'recordings')
+# Length of each per-speaker segment file (seconds of PCM)
+RECORDING_SEGMENT_SECONDS = int(os.getenv('RECORDING_SEGMENT_SECONDS', '30'))
+
+SEGMENT_BYTES = RECORDING_SEGMENT_SECONDS * PCM_BYTES_PER_SECOND
+
+
+class SpeakerWriter:
+    """Writes one speaker's PCM into numbered segment files
+
+    Every segment gets a line in segments.jsonl with its sequence number and
+    when it started (seconds since the recording began), written before any
+    audio goes into it. Each frame is flushed to the OS as it arrives, so a bot
+    crash loses nothing that was already received.
+
+    py-cord fills the gaps between one user's packets with silence but starts
+    their stream at their first packet, so the first segment's start is where
+    the whole stream sits in the session.
+    """
+
+    def __init__(self, directory, started):
+        self.directory = directory
+        self.started = started
+        self.first_start = None
+        self.seq = 0
+        self._file = None
+        self._written = 0
+        os.makedirs(directory, exist_ok=True)
+        self._manifest = open(os.path.join(directory, "segments.jsonl"), "a")
+
+    def _open_segment(self):
+        self.seq += 1
+        name = f"{self.seq:06d}.pcm"
+        entry = {"seq": self.seq, "file": name, "start": round(time.monotonic() - self.started, 3)}
+        if self.first_start is None:
+            self.first_start = entry['start']
+        self._manifest.write(json.dumps(entry) + "\n")
+        self._manifest.flush()
+        self._file = open(os.path.join(self.directory, name), "wb")
+        self._written = 0
+
+    def _close_segment(self):
+        if self._file is None:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+
+    def write(self, data):
+        if self._file is None:
+            self._open_segment()
+        self._file.write(data)
+        self._file.flush()
+        self._written += len(data)
+        if self._written >= SEGMENT_BYTES:
+            self._close_segment()
+
+    def close(self):
+        self._close_segment()
+        self._manifest.close()
+
+
+class SpillingSink(discord.sinks.Sink):
+    """Recording sink that spills each speaker's PCM to disk instead of keeping it in memory
+
+    Audio lands in RECORDINGS_DIR/<guild id>_<time>_<suffix>/<user id>/ as
+    fixed-size segment files, so memory stays flat however long the session
+    runs. Every recording gets a fresh directory, even when two guilds start in
+    the same second. session.json says who the recording belongs to, so one
+    left behind by a crash can still be processed. With live=True the PCM
+    received since the last drain() is also kept for the live transcriber
+    (only ever one window's worth).
+    """
+
+    def __init__(self, guild_id, *, channel_id=None, campaign=None, model_size=None,
+                 live=False, directory=RECORDINGS_DIR, filters=None):
+        super().__init__(filters=filters)
+        self.live = live
+        self.started = time.monotonic()
+        started_at = datetime.now()
+        os.makedirs(directory, exist_ok=True)
+        self.directory = tempfile.mkdtemp(dir=directory, prefix=f"{guild_id}_{started_at:%Y%m%d_%H%M%S}_")
+        with open(os.path.join(self.directory, "session.json"), "w") as f:
+            json.dump({"started": started_at.isoformat(), "guild_id": guild_id, "channel_id": channel_id,
+                       "campaign": campaign, "model_size": model_size}, f)
+
+        self._writers = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def write(self, data, user):
+        # Called from the voice receive thread
+        with self._lock:
+            if self._closed:
+                return
+            writer = self._writers.get(user)
+            if writer is None:
+                writer = SpeakerWriter(os.path.join(self.directory, str(user)), self.started)
+                self._writers[user] = writer
+            writer.write(data)
+            if self.live:
+                self._pending.setdefault(user, bytearray()).extend(data)
+
+    def drain(self):
+        """Take everything received since the last call, per user"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return {user: bytes(data) for user, data in pending.items()}
+
+    def close(self):
+        """Finish every open segment; later writes are dropped (safe to call twice)"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            for writer in self._writers.values():
+                writer.close()
+
+    def cleanup(self):
+        # Called by py-cord when recording stops
+        self.finished = True
+        self.close()
+
+    def offsets(self):
+        """{user id: seconds into the recording their stream starts}"""
+        with self._lock:
+            return {user: writer.first_start for user, writer in self._writers.items()}
+
+    def speakers(self):
+        """{user id: segment paths in order} for everything recorded so far"""
+        self.close()
+        return load_recording(self.directory)[0]
+
+
+def load_recording(directory):
+    """Read a spilled recording back as ({user id: segment paths in order}, {user id: offset})
+
+    The offset is when that speaker's stream starts in the session (seconds).
+    Works on recordings left behind by a crash too: segments are listed in
+    each speaker's segments.jsonl before any audio is written to them.
+    """
+    speakers = {}
+    offsets = {}
+    for entry in sorted(os.listdir(directory)):
+        manifest = os.path.join(directory, entry, "segments.jsonl")
+        if not os.path.isfile(manifest):
+            continue
+
+        segments = []
+        with open(manifest, "r") as f:
+            for line in f:
+                try:
+                    segments.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Torn last line from a crash
+                    continue
+
+        segments.sort(key=lambda s: s['seq'])
+        paths = [os.path.join(directory, entry, seg['file']) for seg in segments]
+        paths = [path for path in paths if os.path.exists(path) and os.path.getsize(path) > 0]
+        if paths:
+            user_id = int(entry) if entry.isdigit() else entry
+            speakers[user_id] = paths
+            offsets[user_id] = segments[0]['start']
+    return speakers, offsets
+
+
+def find_recordings(directory=RECORDINGS_DIR):
+    """[(recording directory, its session.json)] for every recording on disk"""
+    recordings = []
+    if not os.path.isdir(directory):
+        return recordings
+    for entry in sorted(os.listdir(directory)):
+        path = os.path.join(directory, entry)
+        try:
+            with open(os.path.join(path, "session.json"), "r") as f:
+                recordings.append((path, json.load(f)))
+        except (OSError, json.JSONDecodeError):
+            continue
+    return recordings
+
+
+def discard_recording(directory):
+    """Remove a processed recording's segment files"""
+    shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,142 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+
+import yt_dlp
+
+import metrics
+
+# yt-dlp options for extracting audio
+YTDL_OPTIONS = {
+    'format': 'bestaudio/best',
+    'noplaylist': True,
+    'quiet': False,
+    'no_warnings': False,
+    'default_search': 'auto',
+    'source_address': '0.0.0.0',
+    'postprocessors': [{
+        'key': 'FFmpegExtractAudio',
+        'preferredcodec': 'opus',
+    }],
+}
+
+# Special options for playlists
+PLAYLIST_OPTIONS = {
+    **YTDL_OPTIONS,
+    'noplaylist': False,
+    'extract_flat': True,  # Don't download, just get URLs
+}
+
+# Threads running yt-dlp extraction
+RESOLVER_WORKERS = int(os.getenv('RESOLVER_WORKERS', '4'))
+# Stream URLs without an expiry hint are trusted for this long (seconds)
+STREAM_URL_TTL = int(os.getenv('STREAM_URL_TTL', '3600'))
+# Refresh stream URLs this long before they actually expire
+STREAM_URL_MARGIN = 300
+
+
+def stream_expiry(stream_url, now=None):
+    """When a stream URL stops working (YouTube puts it in the 'expire' parameter)"""
+    now = time.time() if now is None else now
+    expire = parse_qs(urlparse(stream_url).query).get('expire')
+    if expire:
+        try:
+            return int(expire[0]) - STREAM_URL_MARGIN
+        except ValueError:
+            pass
+    return now + STREAM_URL_TTL
+
+
+class Resolver:
+    """Resolves URLs with yt-dlp off the event loop and caches the results
+
+    Title/duration/webpage_url metadata is cached for good; stream URLs are
+    cached until shortly before they expire. Each worker thread keeps its own
+    YoutubeDL instances since they aren't safe to share between threads.
+    """
+
+    def __init__(self, max_workers=RESOLVER_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ytdl')
+        self._local = threading.local()
+        self._metadata = {}
+        self._streams = {}
+        self._inflight = {}
+
+    def _ydl(self, playlist=False):
+        key = 'playlist' if playlist else 'single'
+        ydl = getattr(self._local, key, None)
+        if ydl is None:
+            ydl = yt_dlp.YoutubeDL(PLAYLIST_OPTIONS if playlist else YTDL_OPTIONS)
+            setattr(self._local, key, ydl)
+        return ydl
+
+    def _extract(self, url, playlist=False):
+        print(f"Extracting info from: {url}")
+        return self._ydl(playlist).extract_info(url, download=False)
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def cached(self, url):
+        """Cached track info with a still-valid stream URL, or None"""
+        metadata = self._metadata.get(url)
+        stream = self._streams.get(url)
+        if metadata is None or stream is None:
+            return None
+        stream_url, codec, expires_at = stream
+        if time.time() >= expires_at:
+            return None
+        return {**metadata, 'url': stream_url, 'codec': codec}
+
+    async def resolve(self, url, refresh=False):
+        """Track info dict: url (stream), codec, title, duration, webpage_url"""
+        if not refresh:
+            info = self.cached(url)
+            if info is not None:
+                metrics.resolve_requests.inc(result='cache')
+                return info
+        
+        # Share one extraction between callers asking for the same URL
+        future = self._inflight.get(url)
+        if future is None:
+            metrics.resolve_requests.inc(result='extract')
+            started = time.perf_counter()
+            future = asyncio.ensure_future(self._run(self._extract, url))
+            self._inflight[url] = future
+            
+            def done(_):
+                self._inflight.pop(url, None)
+                metrics.resolve_seconds.observe(time.perf_counter() - started)
+            future.add_done_callback(done)
+        else:
+            metrics.resolve_requests.inc(result='shared')
+        info = await asyncio.shield(future)
+        
+        metadata = {
+            'title': info.get('title', 'Unknown'),
+            'duration': info.get('duration'),
+            'webpage_url': url
+        }
+        self._metadata[url] = metadata
+        # Audio codec of the chosen format ('opus' for most YouTube audio)
+        codec = info.get('acodec')
+        if codec in (None, 'none'):
+            codec = None
+        self._streams[url] = (info['url'], codec, stream_expiry(info['url']))
+        return {**metadata, 'url': info['url'], 'codec': codec}
+
+    def metadata(self, url):
+        """Cached metadata without a network call, or None"""
+        return self._metadata.get(url)
+
+    async def extract_playlist(self, url):
+        """Flat playlist info (entries only carry ids/titles, no stream URLs)"""
+        return await self._run(self._extract, url, True)
+
+
+# Shared resolver for all music commands
+resolver = Resolver()
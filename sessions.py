@@ -0,0 +1,97 @@
+import asyncio
+import os
+import time
+
+from player import Prefetcher, GapTracker
+from tracks import TrackQueue, new_history
+from queue_view import QueueLines
+
+# Guild state unused for this long (seconds) is dropped
+SESSION_IDLE_TIMEOUT = int(os.getenv('SESSION_IDLE_TIMEOUT', '3600'))
+# How often idle guild state is checked for
+SESSION_SWEEP_INTERVAL = 300
+
+
+class GuildSession:
+    """Player, queue, recording and campaign state for one guild"""
+
+    def __init__(self, guild_id):
+        self.guild_id = guild_id
+        self.last_active = time.monotonic()
+        
+        # Currently playing song
+        self.current_song = {"title": None, "url": None, "url_stream": None, "start_time": None}
+        # Queue of songs and the current position in it
+        self.queue = TrackQueue()
+        # Rendered /showqueue lines, reused until the queue changes
+        self.queue_lines = QueueLines()
+        # History of played songs (capped)
+        self.song_history = new_history()
+        # Gets the next song ready before the current one ends
+        self.prefetcher = Prefetcher()
+        # Silence between tracks (seconds), for /nowplaying
+        self.track_gaps = GapTracker()
+        
+        # Recording state
+        self.is_recording = False
+        self.recording_sink = None
+        self.recording_start_time = None
+        self.live_transcriber = None
+        
+        # Campaign whose character mappings are in use
+        self.active_character_map = "default"
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def clear_current_song(self):
+        self.current_song["title"] = None
+        self.current_song["url"] = None
+        self.current_song["url_stream"] = None
+        self.current_song["start_time"] = None
+
+    def close(self):
+        self.prefetcher.cancel()
+
+
+class SessionManager:
+    """Creates guild sessions on first use and evicts ones that sit idle"""
+
+    def __init__(self, idle_timeout=SESSION_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._sessions = {}
+
+    def get(self, guild_id):
+        session = self._sessions.get(guild_id)
+        if session is None:
+            session = GuildSession(guild_id)
+            self._sessions[guild_id] = session
+        session.touch()
+        return session
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def all(self):
+        return list(self._sessions.values())
+
+    def evict_idle(self, is_busy=None):
+        """Drop idle sessions; is_busy(guild_id) can veto eviction (e.g. still in voice)"""
+        now = time.monotonic()
+        evicted = []
+        for guild_id, session in list(self._sessions.items()):
+            if session.is_recording or now - session.last_active < self.idle_timeout:
+                continue
+            if is_busy is not None and is_busy(guild_id):
+                continue
+            session.close()
+            del self._sessions[guild_id]
+            evicted.append(guild_id)
+        if evicted:
+            print(f"Evicted idle state for {len(evicted)} guild(s)")
+        return evicted
+
+    async def run_evictions(self, is_busy=None, interval=SESSION_SWEEP_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            self.evict_idle(is_busy)
@@ -0,0 +1,108 @@
+import asyncio
+import hashlib
+import os
+import time
+
+from database import Database
+
+# SQLite file holding cached summaries, per-campaign session summaries and recaps
+SUMMARIES_DB = os.getenv('SUMMARIES_DB', 'summaries.sqlite3')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS summary_cache (
+    transcript_hash TEXT NOT NULL,
+    prompt_version TEXT NOT NULL,
+    model TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (transcript_hash, prompt_version, model)
+);
+CREATE TABLE IF NOT EXISTS session_summaries (
+    campaign TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    transcript_hash TEXT NOT NULL,
+    summary_hash TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    in_recap INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (campaign, started_at)
+);
+CREATE TABLE IF NOT EXISTS recaps (
+    campaign TEXT PRIMARY KEY,
+    recap TEXT NOT NULL,
+    recap_hash TEXT NOT NULL,
+    sessions INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def content_hash(*parts):
+    """SHA-256 over the given strings (kept apart so ('ab', 'c') != ('a', 'bc'))"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class SummaryStore:
+    """Session summaries and the rolling recap for each campaign
+
+    Summaries are cached by the hash of what went into the prompt plus the
+    prompt version and model, so an unchanged session is never sent to the LLM
+    twice. Each campaign's recap is only ever extended: sessions not yet folded
+    into it are added one at a time, oldest first.
+    """
+
+    def __init__(self, path=SUMMARIES_DB):
+        self._db = Database(path, SCHEMA)
+
+    def _write(self, statements):
+        with self._db.transaction() as db:
+            for sql, params in statements:
+                db.execute(sql, params)
+
+    def _read(self, sql, params=()):
+        return self._db.query(sql, params)
+
+    def cached_summary(self, transcript_hash, prompt_version, model):
+        rows = self._read("SELECT summary FROM summary_cache WHERE transcript_hash = ?"
+                          " AND prompt_version = ? AND model = ?", (transcript_hash, prompt_version, model))
+        return rows[0]['summary'] if rows else None
+
+    async def save_summary(self, campaign, started_at, transcript_hash, prompt_version, model, summary):
+        """Cache a summary and record it as the summary of a campaign session"""
+        await asyncio.to_thread(self._write, [
+            ("INSERT OR REPLACE INTO summary_cache (transcript_hash, prompt_version, model, summary, created_at)"
+             " VALUES (?, ?, ?, ?, ?)", (transcript_hash, prompt_version, model, summary, time.time())),
+            # A session that's already in the recap stays there; the recap isn't rewritten
+            ("INSERT INTO session_summaries (campaign, started_at, transcript_hash, summary_hash, summary)"
+             " VALUES (?, ?, ?, ?, ?) ON CONFLICT (campaign, started_at) DO UPDATE SET"
+             " transcript_hash = excluded.transcript_hash, summary_hash = excluded.summary_hash,"
+             " summary = excluded.summary",
+             (campaign, started_at, transcript_hash, content_hash(summary), summary)),
+        ])
+
+    def pending_for_recap(self, campaign):
+        """Session summaries not yet folded into the recap, oldest first"""
+        return self._read("SELECT started_at, summary FROM session_summaries"
+                          " WHERE campaign = ? AND in_recap = 0 ORDER BY started_at", (campaign,))
+
+    def recap(self, campaign):
+        rows = self._read("SELECT * FROM recaps WHERE campaign = ?", (campaign,))
+        return rows[0] if rows else None
+
+    async def save_recap(self, campaign, recap, started_at):
+        """Store the recap after folding in one session, marking that session as included"""
+        await asyncio.to_thread(self._write, [
+            ("INSERT INTO recaps (campaign, recap, recap_hash, sessions, updated_at) VALUES (?, ?, ?, 1, ?)"
+             " ON CONFLICT (campaign) DO UPDATE SET recap = excluded.recap, recap_hash = excluded.recap_hash,"
+             " sessions = sessions + 1, updated_at = excluded.updated_at",
+             (campaign, recap, content_hash(recap), time.time())),
+            ("UPDATE session_summaries SET in_recap = 1 WHERE campaign = ? AND started_at = ?",
+             (campaign, started_at)),
+        ])
+
+
+# Shared store for all guilds
+summary_store = SummaryStore()
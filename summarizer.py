@@ -0,0 +1,177 @@
+import asyncio
+import os
+import time
+
+from llm import ollama
+
+# Transcripts longer than this (characters, roughly 4 per token) are summarized in chunks
+SUMMARY_CHUNK_CHARS = int(os.getenv('SUMMARY_CHUNK_CHARS', '12000'))
+# How many chunk summaries may be generated at the same time
+SUMMARY_CONCURRENCY = int(os.getenv('SUMMARY_CONCURRENCY', '2'))
+# Give up shrinking notes after this many map rounds and reduce whatever is left
+MAX_MAP_ROUNDS = 3
+# Bump whenever a prompt below changes so cached summaries are regenerated
+PROMPT_VERSION = '1'
+
+
+def build_char_context(char_map):
+    """Character list the AI should use instead of generic terms"""
+    if not char_map:
+        return "No character information available."
+    
+    char_context = "Character Names:\n"
+    for user_id, info in char_map.items():
+        char_context += f"- {info['character_info']}\n"
+    return char_context
+
+
+def build_summary_prompt(transcript, char_context):
+    return f"""You are summarizing a D&D session transcript. Extract only the KEY EVENTS and DECISIONS.
+
+{char_context}
+
+Transcript:
+{transcript}
+
+When summarizing, use the character names provided above instead of generic terms like "the party" or "someone". 
+
+Provide a concise summary with:
+1. Major story events that happened
+2. Important decisions the party made (mention which characters made key decisions)
+3. Key NPCs encountered
+4. Loot or rewards obtained (mention who got what if specified)
+5. Next session hooks/cliffhangers
+
+Keep it brief - focus only on what matters for continuity."""
+
+
+def build_chunk_prompt(chunk, char_context, part, parts):
+    return f"""You are taking notes on part {part} of {parts} of a D&D session transcript.
+
+{char_context}
+
+Transcript (part {part} of {parts}):
+{chunk}
+
+Using the character names above, list in short bullet points:
+- Story events that happened
+- Decisions the party made and who made them
+- NPCs encountered
+- Loot or rewards obtained and who got them
+- Unresolved threads or cliffhangers
+
+Only include what actually happens in this part."""
+
+
+def build_reduce_prompt(notes, char_context):
+    return f"""You are summarizing a D&D session from notes taken on consecutive parts of the transcript. Extract only the KEY EVENTS and DECISIONS.
+
+{char_context}
+
+Notes (in session order):
+{notes}
+
+When summarizing, use the character names provided above instead of generic terms like "the party" or "someone". 
+
+Provide a concise summary with:
+1. Major story events that happened
+2. Important decisions the party made (mention which characters made key decisions)
+3. Key NPCs encountered
+4. Loot or rewards obtained (mention who got what if specified)
+5. Next session hooks/cliffhangers
+
+Keep it brief - focus only on what matters for continuity."""
+
+
+def build_recap_prompt(previous_recap, session_summary, session_date, char_context):
+    if previous_recap is None:
+        previous_recap = "(This is the first session of the campaign.)"
+    return f"""You are keeping a running "story so far" recap of a D&D campaign.
+
+{char_context}
+
+Story so far:
+{previous_recap}
+
+Summary of the latest session ({session_date}):
+{session_summary}
+
+Rewrite the story so far so it also covers the latest session. Use the character names above. Keep earlier events brief and give more detail to recent ones, keep every unresolved plot thread, and end with where the party currently stands. Stay under 400 words."""
+
+
+def split_transcript(transcript, max_chars=SUMMARY_CHUNK_CHARS):
+    """Split on line (segment) boundaries into chunks of at most max_chars"""
+    chunks = []
+    current = []
+    size = 0
+    for line in transcript.splitlines():
+        if current and size + len(line) + 1 > max_chars:
+            chunks.append("\n".join(current))
+            current = []
+            size = 0
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+async def generate_streamed(client, prompt, on_token=None):
+    """Stream a response, calling on_token(text so far) as tokens arrive"""
+    text = ""
+    async for token in client.stream(prompt):
+        text += token
+        if on_token is not None:
+            await on_token(text)
+    return text
+
+
+async def summarize_transcript(transcript, char_context, client=ollama, on_token=None):
+    """Map-reduce summary of a transcript of any length
+
+    Chunks are summarized concurrently (at most SUMMARY_CONCURRENCY at once),
+    then the partial notes are reduced into the five-section recap. If the
+    notes are still too long they're reduced again in another round. The final
+    recap is streamed through on_token. Returns (summary, timings) where
+    timings holds seconds per stage.
+    """
+    timings = {}
+    
+    chunks = split_transcript(transcript)
+    if len(chunks) <= 1:
+        started = time.perf_counter()
+        summary = await generate_streamed(client, build_summary_prompt(transcript, char_context), on_token)
+        timings['summary'] = time.perf_counter() - started
+        return summary, timings
+    
+    semaphore = asyncio.Semaphore(SUMMARY_CONCURRENCY)
+    
+    async def summarize_chunk(prompt):
+        async with semaphore:
+            return await client.generate(prompt)
+    
+    round_number = 0
+    while len(chunks) > 1 and round_number < MAX_MAP_ROUNDS:
+        round_number += 1
+        started = time.perf_counter()
+        notes = await asyncio.gather(*[
+            summarize_chunk(build_chunk_prompt(chunk, char_context, i + 1, len(chunks)))
+            for i, chunk in enumerate(chunks)
+        ])
+        timings[f'map_{round_number}'] = time.perf_counter() - started
+        print(f"Summarized {len(chunks)} chunk(s) in {timings[f'map_{round_number}']:.1f}s")
+        
+        combined = "\n\n".join(f"Part {i + 1}:\n{note.strip()}" for i, note in enumerate(notes))
+        chunks = split_transcript(combined)
+    
+    started = time.perf_counter()
+    summary = await generate_streamed(client, build_reduce_prompt("\n\n".join(chunks), char_context), on_token)
+    timings['reduce'] = time.perf_counter() - started
+    return summary, timings
+
+
+async def update_recap(previous_recap, session_summary, session_date, char_context, client=ollama):
+    """Fold one new session summary into the campaign recap (None if there isn't one yet)"""
+    return (await client.generate(
+        build_recap_prompt(previous_recap, session_summary, session_date, char_context)
+    )).strip()
@@ -0,0 +1,113 @@
+import os
+import time
+from collections import deque
+
+# Played tracks kept for history (oldest are dropped first)
+SONG_HISTORY_LIMIT = int(os.getenv('SONG_HISTORY_LIMIT', '100'))
+# A track that failed to resolve is skipped for this long (seconds), then tried again
+TRACK_RETRY_SECONDS = int(os.getenv('TRACK_RETRY_SECONDS', '600'))
+
+
+class Track:
+    """One queue entry; the stream URL is filled in just before it plays"""
+
+    __slots__ = ('webpage_url', 'title', 'url', 'codec', 'duration', 'failed_at')
+
+    def __init__(self, webpage_url, title='Unknown', url=None, codec=None, duration=None):
+        self.webpage_url = webpage_url
+        self.title = title
+        self.url = url
+        self.codec = codec
+        self.duration = duration
+        # When the last lookup failed (monotonic time), None once one succeeds
+        self.failed_at = None
+
+    @property
+    def unavailable(self):
+        """Failed recently; errors are often temporary, so it's retried after TRACK_RETRY_SECONDS"""
+        return self.failed_at is not None and time.monotonic() - self.failed_at < TRACK_RETRY_SECONDS
+
+    def mark_failed(self):
+        self.failed_at = time.monotonic()
+
+    def __repr__(self):
+        return f"Track({self.title!r}, {self.webpage_url!r})"
+
+    def to_compact(self):
+        """[webpage_url, title, duration] - stream URLs expire, so they aren't kept"""
+        return [self.webpage_url, self.title, self.duration]
+
+    @classmethod
+    def from_compact(cls, data):
+        webpage_url, title, duration = data
+        return cls(webpage_url, title, duration=duration)
+
+
+class TrackQueue:
+    """Queue of Tracks with a play position
+
+    Appending, advancing, rewinding and jumping to an index are all O(1).
+    position is -1 before anything has played. version changes whenever
+    tracks are added or removed, so cached renderings know to refresh.
+    """
+
+    __slots__ = ('tracks', 'position', 'version')
+
+    def __init__(self, tracks=None, position=-1):
+        self.tracks = list(tracks) if tracks else []
+        self.position = position
+        self.version = 0
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def __getitem__(self, index):
+        return self.tracks[index]
+
+    def __iter__(self):
+        return iter(self.tracks)
+
+    def append(self, track):
+        self.tracks.append(track)
+        self.version += 1
+
+    def extend(self, tracks):
+        self.tracks.extend(tracks)
+        self.version += 1
+
+    def current(self):
+        if 0 <= self.position < len(self.tracks):
+            return self.tracks[self.position]
+        return None
+
+    def has_next(self):
+        return self.position < len(self.tracks) - 1
+
+    def peek_next(self):
+        return self.tracks[self.position + 1] if self.has_next() else None
+
+    def advance(self):
+        self.position += 1
+
+    def rewind(self):
+        self.position -= 1
+
+    def jump(self, index):
+        self.position = index
+
+    def clear(self):
+        self.tracks.clear()
+        self.position = -1
+        self.version += 1
+
+    def to_compact(self):
+        return {'position': self.position, 'tracks': [track.to_compact() for track in self.tracks]}
+
+    @classmethod
+    def from_compact(cls, data):
+        return cls([Track.from_compact(item) for item in data['tracks']], data['position'])
+
+
+def new_history():
+    """Ring buffer of recently played tracks"""
+    return deque(maxlen=SONG_HISTORY_LIMIT)
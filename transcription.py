@@ -0,0 +1,345 @@
+import gc
+import os
+import threading
+import time
+from bisect import bisect_right
+from contextlib import contextmanager
+
+import numpy as np
+
+from audio import (pcm_to_whisper, segments_to_whisper, read_pcm_range, detect_speech, compact_speech,
+                   map_timestamps, VAD_ENABLED, WHISPER_SAMPLE_RATE)
+
+# Default Whisper model size and how long an unused model stays in memory (seconds)
+WHISPER_MODEL = os.getenv('WHISPER_MODEL', 'base')
+WHISPER_IDLE_TIMEOUT = int(os.getenv('WHISPER_IDLE_TIMEOUT', '1800'))
+# Load the default model in every worker as it starts instead of on the first recording
+WHISPER_WARM_ON_START = os.getenv('WHISPER_WARM_ON_START', '1') == '1'
+
+# Model sizes that can be picked per guild
+MODEL_SIZES = ['tiny', 'base', 'small']
+
+# Transcription engine for this deployment: 'whisper' (openai-whisper, PyTorch FP32)
+# or 'faster-whisper' (CTranslate2, int8 quantized on CPU)
+TRANSCRIBE_BACKEND = os.getenv('TRANSCRIBE_BACKEND', 'whisper')
+FASTER_WHISPER_COMPUTE_TYPE = os.getenv('FASTER_WHISPER_COMPUTE_TYPE', 'int8')
+TRANSCRIBE_BATCH_SIZE = int(os.getenv('TRANSCRIBE_BATCH_SIZE', '8'))
+# Longest clip the batched pipeline decodes in one piece (Whisper's window, seconds)
+BATCH_CLIP_SECONDS = 30
+
+
+class TranscriptionBackend:
+    """Common interface for transcription engines
+
+    transcribe() takes 16 kHz mono float32 samples and returns
+    {'text': str, 'segments': [{'start', 'end', 'text'}]}.
+    """
+
+    name = None
+
+    def __init__(self, size):
+        self.size = size
+
+    def transcribe(self, samples):
+        raise NotImplementedError
+
+    def transcribe_batch(self, chunks):
+        """Transcribe several chunks (e.g. one per speaker); returns one segment list per chunk
+
+        Segments never straddle two chunks and no speaker's text becomes
+        context for another's. This default decodes one chunk at a time.
+        """
+        return [self.transcribe(chunk)['segments'] if len(chunk) else [] for chunk in chunks]
+
+
+class WhisperBackend(TranscriptionBackend):
+    """openai-whisper running on PyTorch"""
+
+    name = 'whisper'
+
+    def __init__(self, size):
+        super().__init__(size)
+        import whisper
+        self.model = whisper.load_model(size)
+
+    def transcribe(self, samples):
+        result = self.model.transcribe(samples)
+        segments = [
+            {'start': seg['start'], 'end': seg['end'], 'text': seg['text'].strip()}
+            for seg in result['segments']
+            if seg['text'].strip()
+        ]
+        return {'text': result['text'], 'segments': segments}
+
+
+class FasterWhisperBackend(TranscriptionBackend):
+    """faster-whisper (CTranslate2) with int8 weights, much quicker on CPU
+
+    The batched pipeline splits audio into clips of speech and decodes
+    TRANSCRIBE_BATCH_SIZE of them at once; transcribe_batch() puts the clips
+    of every chunk into the same batches.
+    """
+
+    name = 'faster-whisper'
+
+    def __init__(self, size):
+        super().__init__(size)
+        from faster_whisper import WhisperModel, BatchedInferencePipeline
+        self.model = WhisperModel(size, device='cpu', compute_type=FASTER_WHISPER_COMPUTE_TYPE)
+        self.pipeline = BatchedInferencePipeline(model=self.model)
+
+    def transcribe(self, samples):
+        segments, info = self.pipeline.transcribe(samples, batch_size=TRANSCRIBE_BATCH_SIZE)
+        segments = [
+            {'start': seg.start, 'end': seg.end, 'text': seg.text.strip()}
+            for seg in segments
+            if seg.text.strip()
+        ]
+        return {'text': " ".join(seg['text'] for seg in segments), 'segments': segments}
+
+    def transcribe_batch(self, chunks):
+        """Decode the speech of every chunk in one batched pipeline call
+
+        Each chunk is cut at pauses into clips of up to BATCH_CLIP_SECONDS.
+        A clip never spans two chunks, so every segment maps back to exactly
+        one of them.
+        """
+        from faster_whisper.vad import VadOptions, get_speech_timestamps
+        vad_options = VadOptions(max_speech_duration_s=BATCH_CLIP_SECONDS, min_silence_duration_ms=160)
+        
+        clips = []
+        chunk_starts = []
+        offset = 0
+        for chunk in chunks:
+            chunk_starts.append(offset / WHISPER_SAMPLE_RATE)
+            if len(chunk):
+                regions = get_speech_timestamps(chunk, vad_options)
+                for start, end in _group_regions(regions, BATCH_CLIP_SECONDS * WHISPER_SAMPLE_RATE):
+                    clips.append({'start': (offset + start) / WHISPER_SAMPLE_RATE,
+                                  'end': (offset + end) / WHISPER_SAMPLE_RATE})
+            offset += len(chunk)
+        
+        results = [[] for _ in chunks]
+        if not clips:
+            return results
+        
+        segments, info = self.pipeline.transcribe(np.concatenate(chunks), clip_timestamps=clips,
+                                                  batch_size=TRANSCRIBE_BATCH_SIZE)
+        for seg in segments:
+            text = seg.text.strip()
+            if not text:
+                continue
+            # Empty chunks share their start with the next one, which is the one with the clips
+            index = bisect_right(chunk_starts, seg.start) - 1
+            results[index].append({'start': seg.start - chunk_starts[index],
+                                   'end': seg.end - chunk_starts[index], 'text': text})
+        return results
+
+
+def _group_regions(regions, max_samples):
+    """Join consecutive speech regions into [start, end] spans of at most max_samples, cut in pauses"""
+    spans = []
+    for region in regions:
+        if spans and region['end'] - spans[-1][0] <= max_samples:
+            spans[-1][1] = region['end']
+        else:
+            spans.append([region['start'], region['end']])
+    return spans
+
+
+BACKENDS = {backend.name: backend for backend in (WhisperBackend, FasterWhisperBackend)}
+
+
+def load_backend(size, backend=TRANSCRIBE_BACKEND):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown transcription backend '{backend}' (choose from {', '.join(BACKENDS)})")
+    return BACKENDS[backend](size)
+
+
+class ModelCache:
+    """Keeps loaded transcription models resident and unloads them after sitting idle"""
+
+    def __init__(self, idle_timeout=WHISPER_IDLE_TIMEOUT, backend=TRANSCRIBE_BACKEND):
+        self.idle_timeout = idle_timeout
+        self.backend = backend
+        self._models = {}
+        self._last_used = {}
+        self._in_use = {}
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def _load(self, size):
+        model = self._models.get(size)
+        if model is None:
+            print(f"Loading {self.backend} model '{size}'...")
+            started = time.time()
+            model = load_backend(size, self.backend)
+            self._models[size] = model
+            print(f"{self.backend} model '{size}' loaded in {time.time() - started:.1f}s")
+        return model
+
+    def warm(self, size=WHISPER_MODEL):
+        """Load a model ahead of time so the first recording doesn't pay for it"""
+        with self._lock:
+            self._load(size)
+            self._last_used[size] = time.time()
+            self._schedule_eviction()
+
+    @contextmanager
+    def use(self, size=WHISPER_MODEL):
+        """Borrow a model; it won't be evicted while borrowed"""
+        with self._lock:
+            model = self._load(size)
+            self._in_use[size] = self._in_use.get(size, 0) + 1
+        try:
+            yield model
+        finally:
+            with self._lock:
+                self._in_use[size] -= 1
+                self._last_used[size] = time.time()
+                self._schedule_eviction()
+
+    def loaded(self):
+        with self._lock:
+            return list(self._models.keys())
+
+    def _schedule_eviction(self):
+        # Caller must hold the lock
+        if self._timer is not None or self.idle_timeout <= 0:
+            return
+        self._timer = threading.Timer(self.idle_timeout, self._evict_idle)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _evict_idle(self):
+        with self._lock:
+            self._timer = None
+            now = time.time()
+            for size in list(self._models.keys()):
+                if self._in_use.get(size, 0) > 0:
+                    continue
+                if now - self._last_used.get(size, 0) >= self.idle_timeout:
+                    print(f"Unloading idle {self.backend} model '{size}'")
+                    del self._models[size]
+                    self._last_used.pop(size, None)
+            if self._models:
+                self._schedule_eviction()
+        gc.collect()
+
+
+# Process-wide model cache
+model_cache = ModelCache()
+
+
+def init_worker(threads):
+    """Worker initializer: share the CPU cores between worker processes and warm the model"""
+    if TRANSCRIBE_BACKEND == 'whisper':
+        import torch
+        torch.set_num_threads(threads)
+    if WHISPER_WARM_ON_START:
+        model_cache.warm(WHISPER_MODEL)
+
+
+def _prepare(samples):
+    """Cut silence out of a signal; returns (samples, region_map)"""
+    if VAD_ENABLED:
+        return compact_speech(samples, detect_speech(samples))
+    return samples, []
+
+
+def transcribe_pcm(streams, size=WHISPER_MODEL):
+    """Worker entry point: transcribe one window of raw PCM per speaker
+
+    Each speaker in the window is decoded separately with one model. Returns
+    {user id: segments} with timestamps relative to the start of the window.
+    """
+    users = []
+    chunks = []
+    region_maps = []
+    for user_id, pcm in streams.items():
+        samples, region_map = _prepare(pcm_to_whisper(pcm))
+        if len(samples):
+            users.append(user_id)
+            chunks.append(samples)
+            region_maps.append(region_map)
+
+    if not chunks:
+        return {}
+
+    with model_cache.use(size) as model:
+        results = model.transcribe_batch(chunks)
+
+    return {
+        user_id: map_timestamps(segments, region_map)
+        for user_id, segments, region_map in zip(users, results, region_maps)
+    }
+
+
+def transcribe_spans(streams, spans, size=WHISPER_MODEL):
+    """Worker entry point: transcribe part of each speaker's spilled stream
+
+    streams maps user id -> segment paths and spans maps user id -> (start, end)
+    byte offsets in that stream. Returns {user id: segments} with timestamps
+    relative to the start of each span, like transcribe_pcm.
+    """
+    pcm = {user_id: read_pcm_range(streams[user_id], start, end)
+           for user_id, (start, end) in spans.items() if user_id in streams}
+    return transcribe_pcm(pcm, size)
+
+
+def transcribe_speaker(paths, size=WHISPER_MODEL):
+    """Worker entry point: transcribe one speaker's spilled PCM segment files into timed segments
+
+    Silence is cut out first (when VAD is enabled) and segment timestamps are
+    mapped back to seconds from the start of that speaker's stream. Returns
+    the segments, the stream and speech durations (so callers can report how
+    much audio was skipped) and how long it all took.
+    """
+    started = time.perf_counter()
+    samples = segments_to_whisper(paths)
+    duration = len(samples) / WHISPER_SAMPLE_RATE
+
+    samples, region_map = _prepare(samples)
+    speech_duration = len(samples) / WHISPER_SAMPLE_RATE
+
+    segments = []
+    if len(samples):
+        with model_cache.use(size) as model:
+            segments = model.transcribe(samples)['segments']
+
+    return {
+        'segments': map_timestamps(segments, region_map),
+        'duration': duration,
+        'speech_duration': speech_duration,
+        'processing_time': time.perf_counter() - started
+    }
+
+
+def shift_segments(segments, offset):
+    """Move segments from stream time to session time"""
+    if not offset:
+        return segments
+    return [{**seg, 'start': seg['start'] + offset, 'end': seg['end'] + offset} for seg in segments]
+
+
+def merge_speaker_segments(per_speaker):
+    """Merge {speaker name: segments} into one timeline ordered by start time"""
+    timeline = []
+    for speaker, segments in per_speaker.items():
+        for seg in segments:
+            timeline.append({**seg, 'speaker': speaker})
+    timeline.sort(key=lambda seg: (seg['start'], seg['end']))
+    return timeline
+
+
+def format_timestamp(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{(seconds % 3600) // 60:02d}:{seconds % 60:02d}"
+
+
+def format_transcript(timeline):
+    """Render a merged timeline as '[hh:mm:ss] Speaker: text' lines"""
+    return "\n".join(
+        f"[{format_timestamp(seg['start'])}] {seg['speaker']}: {seg['text']}"
+        for seg in timeline
+    )
@@ -0,0 +1,93 @@
+import asyncio
+import os
+import re
+
+from database import Database
+
+# SQLite file holding every campaign's session transcripts and their search index
+TRANSCRIPTS_DB = os.getenv('TRANSCRIPTS_DB', 'transcripts.sqlite3')
+# Results returned by one search
+SEARCH_LIMIT = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    campaign TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    UNIQUE (campaign, started_at)
+);
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+    speaker TEXT NOT NULL,
+    start REAL NOT NULL,
+    end REAL NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS segments_by_session ON segments (session_id, start);
+CREATE VIRTUAL TABLE IF NOT EXISTS segments_fts USING fts5(
+    text, speaker, content='segments', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS segments_ai AFTER INSERT ON segments BEGIN
+    INSERT INTO segments_fts (rowid, text, speaker) VALUES (new.id, new.text, new.speaker);
+END;
+CREATE TRIGGER IF NOT EXISTS segments_ad AFTER DELETE ON segments BEGIN
+    INSERT INTO segments_fts (segments_fts, rowid, text, speaker) VALUES ('delete', old.id, old.text, old.speaker);
+END;
+"""
+
+
+def build_match_query(query):
+    """Turn free text into an FTS5 query: every word must match, the last one as a prefix"""
+    words = re.findall(r"\w+", query.lower())
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words[:-1]] + [f'"{words[-1]}"*']
+    return " ".join(terms)
+
+
+class TranscriptStore:
+    """Session transcripts per campaign with a full-text index over every segment
+
+    Each finished session adds its segments once; SQLite FTS5 keeps the index
+    up to date as rows are inserted, so searches never rescan old sessions.
+    """
+
+    def __init__(self, path=TRANSCRIPTS_DB):
+        self._db = Database(path, SCHEMA)
+
+    def _save(self, campaign, started_at, timeline):
+        with self._db.transaction() as db:
+            # Replace a session that's being processed again (e.g. a resumed job)
+            db.execute("DELETE FROM sessions WHERE campaign = ? AND started_at = ?", (campaign, started_at))
+            session_id = db.execute("INSERT INTO sessions (campaign, started_at) VALUES (?, ?)",
+                                    (campaign, started_at)).lastrowid
+            db.executemany(
+                "INSERT INTO segments (session_id, speaker, start, end, text) VALUES (?, ?, ?, ?, ?)",
+                [(session_id, seg['speaker'], seg['start'], seg['end'], seg['text']) for seg in timeline]
+            )
+        return session_id
+
+    async def save_session(self, campaign, started_at, timeline):
+        """Store a merged timeline ({'speaker', 'start', 'end', 'text'} segments); returns the session id"""
+        return await asyncio.to_thread(self._save, campaign, started_at, timeline)
+
+    def search(self, campaign, query, limit=SEARCH_LIMIT):
+        """Best matching moments: dicts with started_at, speaker, start and a highlighted snippet"""
+        match = build_match_query(query)
+        if match is None:
+            return []
+        return self._db.query(
+            "SELECT sessions.started_at, segments.speaker, segments.start,"
+            " snippet(segments_fts, 0, '**', '**', '…', 16) AS snippet"
+            " FROM segments_fts"
+            " JOIN segments ON segments.id = segments_fts.rowid"
+            " JOIN sessions ON sessions.id = segments.session_id"
+            " WHERE segments_fts MATCH ? AND sessions.campaign = ?"
+            " ORDER BY bm25(segments_fts) LIMIT ?",
+            (match, campaign, limit)
+        )
+
+
+# Shared store for all guilds
+transcript_store = TranscriptStore()
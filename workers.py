@@ -0,0 +1,61 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from transcription import init_worker
+
+# Number of worker processes for transcription (each one holds its own Whisper model)
+CPU_COUNT = os.cpu_count() or 1
+TRANSCRIBE_WORKERS = int(os.getenv('TRANSCRIBE_WORKERS', str(min(4, CPU_COUNT))))
+
+
+def _ready():
+    return True
+
+
+class WorkerPool:
+    """Process pool for CPU-heavy jobs so the bot's event loop stays responsive"""
+
+    def __init__(self, max_workers=TRANSCRIBE_WORKERS, initializer=None, initargs=()):
+        self.max_workers = max_workers
+        self.initializer = initializer
+        self.initargs = initargs
+        self._executor = None
+
+    def _ensure_started(self):
+        if self._executor is None:
+            # spawn avoids forking the running discord client and its threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=self.initializer,
+                initargs=self.initargs
+            )
+        return self._executor
+
+    def start(self):
+        """Spawn every worker now so their initializers run before the first job"""
+        executor = self._ensure_started()
+        # Workers are spawned as tasks arrive, one per task while none is idle
+        for _ in range(self.max_workers):
+            executor.submit(_ready)
+
+    async def run(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) in a worker process and await its result"""
+        executor = self._ensure_started()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, partial(fn, *args, **kwargs))
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Shared pool for recording processing jobs; each worker gets an equal share of cores
+transcription_pool = WorkerPool(
+    initializer=init_worker,
+    initargs=(max(1, CPU_COUNT // TRANSCRIBE_WORKERS),)
+)